@@ -0,0 +1,27 @@
+"""create stored_blobs table for content-addressed uploads"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "Revision_3"
+down_revision = "a2dbb6dc00d7"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # One row per unique upload; ref_count tracks the uploads pointing at it
+    op.create_table(
+        "stored_blobs",
+        sa.Column("content_key", sa.String(), primary_key=True),
+        sa.Column("size", sa.Integer(), nullable=False),
+        sa.Column("extension", sa.String(), nullable=True),
+        sa.Column("ref_count", sa.Integer(), nullable=False, server_default="1"),
+        sa.Column("created_at", sa.DateTime(), nullable=False, server_default=sa.text("CURRENT_TIMESTAMP")),
+    )
+
+
+def downgrade():
+    op.drop_table("stored_blobs")
@@ -0,0 +1,132 @@
+"""add normalized identity columns and index to ocr_records"""
+
+import re
+import unicodedata
+from datetime import date, datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "Revision_4"
+down_revision = "Revision_3"
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 5000
+INDEX_NAME = "ix_ocr_records_identity"
+
+
+# ------------------------------------------------------------------
+# NORMALIZATION (frozen copy of identity.py as of this revision, so later
+# changes to the live functions do not change what this migration writes)
+# ------------------------------------------------------------------
+_MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "sept": 9, "oct": 10, "nov": 11, "dec": 12,
+}
+_NUMERIC_DOB = re.compile(r"^\s*(\d{1,2})\s*[/\-.]\s*(\d{1,2})\s*[/\-.]\s*(\d{2}|\d{4})\s*$")
+_TEXT_DOB = re.compile(r"^\s*(\d{1,2})\s+([A-Za-z]+)\.?,?\s+(\d{2}|\d{4})\s*$")
+
+
+def _normalize_name(name):
+    chars, latin_base = [], False
+    for c in unicodedata.normalize("NFKD", name or ""):
+        category = unicodedata.category(c)
+        if category.startswith("M"):
+            if latin_base:
+                continue
+        else:
+            latin_base = "LATIN" in unicodedata.name(c, "")
+        chars.append(c if category[0] in "LM" else " ")
+    tokens = unicodedata.normalize("NFC", "".join(chars)).casefold().split()
+    return " ".join(sorted(tokens))
+
+
+def _parse_dob(dob):
+    if not dob:
+        return None
+    numeric = _NUMERIC_DOB.match(dob)
+    if numeric:
+        day, month, year = (int(g) for g in numeric.groups())
+        year_digits = len(numeric.group(3))
+    else:
+        text = _TEXT_DOB.match(dob)
+        if not text:
+            return None
+        month = _MONTHS.get(text.group(2).lower()[:4]) or _MONTHS.get(text.group(2).lower()[:3])
+        if month is None:
+            return None
+        day, year = int(text.group(1)), int(text.group(3))
+        year_digits = len(text.group(3))
+
+    if year_digits == 2:
+        this_year = datetime.utcnow().year
+        year += 2000 if 2000 + year <= this_year else 1900
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+# ------------------------------------------------------------------
+# MIGRATION
+# ------------------------------------------------------------------
+def upgrade():
+    conn = op.get_bind()
+    columns = {c["name"] for c in sa.inspect(conn).get_columns("ocr_records")}
+    # Re-runnable: an interrupted upgrade leaves the columns and part of the backfill committed
+    if "name_normalized" not in columns:
+        op.add_column("ocr_records", sa.Column("name_normalized", sa.String(), nullable=True))
+    if "dob_date" not in columns:
+        op.add_column("ocr_records", sa.Column("dob_date", sa.Date(), nullable=True))
+
+    records = sa.table(
+        "ocr_records",
+        sa.column("id", sa.Integer),
+        sa.column("name", sa.String),
+        sa.column("dob", sa.String),
+        sa.column("name_normalized", sa.String),
+        sa.column("dob_date", sa.Date),
+    )
+    update = (
+        records.update()
+        .where(records.c.id == sa.bindparam("record_id"))
+        .values(name_normalized=sa.bindparam("name_key"), dob_date=sa.bindparam("dob_value"))
+    )
+
+    # Leave the migration transaction (committing the new columns) so that each
+    # batch commits on its own, instead of one transaction spanning the table.
+    with op.get_context().autocommit_block():
+        # Keyset-paginated batches, each written in its own short transaction
+        # on a separate connection; only rows not yet backfilled are read.
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                sa.select(records.c.id, records.c.name, records.c.dob)
+                .where(records.c.id > last_id, records.c.name_normalized.is_(None))
+                .order_by(records.c.id)
+                .limit(BATCH_SIZE)
+            ).fetchall()
+            if not rows:
+                break
+            with conn.engine.begin() as batch:
+                batch.execute(update, [
+                    {"record_id": r.id, "name_key": _normalize_name(r.name), "dob_value": _parse_dob(r.dob)}
+                    for r in rows
+                ])
+            last_id = rows[-1].id
+
+        # Index after the backfill: one bulk build instead of per-row maintenance.
+        # On PostgreSQL it is built CONCURRENTLY, so writes are not blocked meanwhile.
+        op.create_index(
+            INDEX_NAME, "ocr_records", ["name_normalized", "dob_date"],
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+
+
+def downgrade():
+    op.drop_index(INDEX_NAME, table_name="ocr_records")
+    op.drop_column("ocr_records", "dob_date")
+    op.drop_column("ocr_records", "name_normalized")
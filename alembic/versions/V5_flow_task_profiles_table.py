@@ -0,0 +1,32 @@
+"""create flow_task_profiles table for on-demand flow profiling"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "Revision_5"
+down_revision = "Revision_4"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "flow_task_profiles",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("flow_id", sa.Integer(), sa.ForeignKey("flow_manager.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("task_name", sa.String(), nullable=False),
+        sa.Column("wall_ms", sa.Float(), nullable=False),
+        sa.Column("cpu_ms", sa.Float(), nullable=False),
+        sa.Column("peak_memory_kb", sa.Float(), nullable=False),
+        sa.Column("summary", sa.Text(), nullable=False),
+        sa.Column("stats_blob", sa.LargeBinary(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False, server_default=sa.text("CURRENT_TIMESTAMP")),
+    )
+    op.create_index("ix_flow_task_profiles_id", "flow_task_profiles", ["id"])
+    op.create_index("ix_flow_task_profiles_flow_id", "flow_task_profiles", ["flow_id"])
+
+
+def downgrade():
+    op.drop_table("flow_task_profiles")
@@ -0,0 +1,232 @@
+# cpu_budget.py
+"""
+CPU thread budget and affinity for OCR workers.
+
+Every uvicorn worker (or OCR pool process) loads its own EasyOCR/torch stack,
+and by default each one sizes its intra-op thread pools to every core on the
+node. With several workers the pools oversubscribe the CPU and throughput
+drops as workers are added.
+
+This module divides the available cores across workers, caps the torch /
+OpenMP / MKL / OpenBLAS / OpenCV thread pools of the current process to its
+share, and optionally pins the process to its CPU set.
+
+`apply_thread_budget()` must run before torch is imported (the OpenMP and MKL
+runtimes read their environment variables once, at load time), and
+`configure_torch()` after it.
+
+Environment:
+    OCR_WORKERS             Number of workers sharing the node (default: WEB_CONCURRENCY or 1).
+    OCR_THREADS_PER_WORKER  Threads per worker (default: available cores // workers, min 1).
+    OCR_PIN_CPUS            "1" to pin each worker to its own CPU set (default: off).
+    OCR_SLOT_DIR            Directory used to hand out worker indexes (default: <tmp>/kyc-ocr-slots).
+"""
+import atexit
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger("FlowManagerApp")
+
+THREAD_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+)
+
+_layout: dict = {}
+
+
+# ------------------------------------------------------------------
+# LAYOUT PLANNING
+# ------------------------------------------------------------------
+def available_cpus() -> list[int]:
+    """CPUs this process may run on (respects cgroup/taskset restrictions)."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def plan_layout(cpus: list[int], workers: int, threads_per_worker: int = None) -> list[list[int]]:
+    """
+    Split `cpus` into one CPU set per worker.
+
+    With at least as many CPUs as workers, each worker gets a contiguous,
+    non-overlapping slice (remainder CPUs go to the first workers). With fewer
+    CPUs than workers, CPUs are shared round-robin.
+
+    Args:
+        cpus (list[int]): CPU ids available on the node.
+        workers (int): Number of workers to divide them between.
+        threads_per_worker (int, optional): Cap each slice to this many CPUs.
+
+    Returns:
+        list[list[int]]: CPU set for each worker index.
+
+    Example:
+        >>> plan_layout([0, 1, 2, 3, 4, 5, 6, 7], 3)
+        [[0, 1, 2], [3, 4, 5], [6, 7]]
+    """
+    workers = max(1, workers)
+    if len(cpus) < workers:
+        return [[cpus[i % len(cpus)]] for i in range(workers)]
+
+    base, extra = divmod(len(cpus), workers)
+    layout, start = [], 0
+    for i in range(workers):
+        size = base + (1 if i < extra else 0)
+        layout.append(cpus[start:start + size][: threads_per_worker or None])
+        start += size
+    return layout
+
+
+# ------------------------------------------------------------------
+# WORKER SLOTS
+# ------------------------------------------------------------------
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def claim_worker_slot(workers: int, slot_dir: str) -> int:
+    """
+    Claim the lowest free worker index on this node.
+
+    uvicorn does not tell a worker its index, so each process claims one by
+    exclusively creating `<slot_dir>/slot-<i>` holding its pid. Slots left by
+    dead processes are reclaimed. The slot is released when the process exits.
+
+    Returns:
+        int: The claimed index, or `os.getpid() % workers` if every slot is taken.
+    """
+    os.makedirs(slot_dir, exist_ok=True)
+    for attempt in range(2):
+        for index in range(workers):
+            path = os.path.join(slot_dir, f"slot-{index}")
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if attempt == 0:
+                    try:
+                        with open(path) as f:
+                            owner = int(f.read().strip() or 0)
+                    except (OSError, ValueError):
+                        owner = 0
+                    if owner and not _pid_alive(owner):
+                        try:
+                            os.unlink(path)
+                        except FileNotFoundError:
+                            pass
+                continue
+            with os.fdopen(fd, "w") as f:
+                f.write(str(os.getpid()))
+            atexit.register(_release_slot, path)
+            return index
+    return os.getpid() % workers
+
+
+def _release_slot(path: str):
+    try:
+        with open(path) as f:
+            if f.read().strip() == str(os.getpid()):
+                os.unlink(path)
+    except OSError:
+        pass
+
+
+# ------------------------------------------------------------------
+# APPLYING THE BUDGET
+# ------------------------------------------------------------------
+def apply_thread_budget(worker_index: int = None, workers: int = None, cpus: list[int] = None) -> dict:
+    """
+    Size this process's thread pools to its share of the node and optionally pin it.
+
+    Must be called before torch is imported. Pool processes can pass their own
+    `worker_index`/`workers` (e.g. from a process-pool initializer) and the
+    `cpus` of their parent's share; otherwise they are read from the
+    environment and a free slot is claimed.
+
+    Returns:
+        dict: The applied layout (also available through `get_layout()`).
+    """
+    cpus = cpus or available_cpus()
+    if workers is None:
+        workers = int(os.getenv("OCR_WORKERS") or os.getenv("WEB_CONCURRENCY") or 1)
+    workers = max(1, workers)
+    threads_override = int(os.getenv("OCR_THREADS_PER_WORKER", "0")) or None
+    pin = os.getenv("OCR_PIN_CPUS", "0").lower() in ("1", "true", "yes")
+
+    if worker_index is None:
+        if workers > 1:
+            slot_dir = os.getenv("OCR_SLOT_DIR") or os.path.join(tempfile.gettempdir(), "kyc-ocr-slots")
+            worker_index = claim_worker_slot(workers, slot_dir)
+        else:
+            worker_index = 0
+
+    worker_cpus = plan_layout(cpus, workers, threads_override)[worker_index % workers]
+    threads = threads_override or len(worker_cpus)
+
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(threads)
+
+    pinned = False
+    if pin and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, worker_cpus)
+            pinned = True
+        except OSError as e:
+            logger.warning(f"⚠️ Could not pin worker {worker_index} to CPUs {worker_cpus}: {e}")
+
+    _layout.clear()
+    _layout.update(
+        pid=os.getpid(),
+        worker_index=worker_index,
+        workers=workers,
+        node_cpus=len(cpus),
+        cpus=worker_cpus,
+        threads=threads,
+        pinned=pinned,
+        torch_threads=None,
+        torch_interop_threads=None,
+    )
+    logger.info(
+        f"🧮 OCR worker {worker_index}/{workers}: {threads} threads on CPUs {worker_cpus} "
+        f"({'pinned' if pinned else 'not pinned'})"
+    )
+    return dict(_layout)
+
+
+def configure_torch() -> dict:
+    """Apply the budget to torch and OpenCV once they are imported."""
+    threads = _layout.get("threads") or apply_thread_budget()["threads"]
+
+    import torch
+
+    torch.set_num_threads(threads)
+    try:
+        # Inter-op parallelism only helps graphs with independent branches;
+        # one thread keeps it from multiplying the intra-op budget.
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # already set, or parallel work has started in this process
+    _layout["torch_threads"] = torch.get_num_threads()
+    _layout["torch_interop_threads"] = torch.get_num_interop_threads()
+
+    try:
+        import cv2
+        cv2.setNumThreads(threads)
+    except ImportError:
+        pass
+    return dict(_layout)
+
+
+def get_layout() -> dict:
+    """Layout applied to the current process (empty if no budget was applied)."""
+    return dict(_layout)
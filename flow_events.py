@@ -0,0 +1,145 @@
+# flow_events.py
+"""
+In-process pub/sub for flow progress events.
+
+`FlowEngine` publishes an event every time it changes a task's status, and a
+final `end` event when the flow finishes. `GET /flow/{flow_id}/events`
+subscribes to a flow and relays the events to the client as server-sent events.
+
+Publishers may run on any thread (flows execute in FastAPI's threadpool), while
+subscribers are consumed on the event loop, so events are handed over with
+`loop.call_soon_threadsafe`. Each subscriber has a bounded buffer; when a slow
+client falls behind, its oldest events are dropped rather than growing memory.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger("FlowManagerEngine")
+
+DEFAULT_BUFFER_SIZE = 64
+TERMINAL_STATUSES = {"completed", "failed", "timeout"}
+
+
+class Subscription:
+    """A single client's bounded view of one flow's events."""
+
+    def __init__(self, broker: "FlowEventBroker", flow_id: int, loop: asyncio.AbstractEventLoop, maxsize: int):
+        self.broker = broker
+        self.flow_id = flow_id
+        self.loop = loop
+        self.buffer = deque(maxlen=maxsize)
+        self.dropped = 0
+        self._ready = asyncio.Event()
+
+    def _push(self, event: dict):
+        # Runs on the subscriber's event loop.
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append(event)
+        self._ready.set()
+
+    async def get(self, timeout: float = None):
+        """Wait for the next event; returns None if `timeout` elapses first."""
+        while not self.buffer:
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        return self.buffer.popleft()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class FlowEventBroker:
+    """Routes flow events from publishers to the subscribers of that flow."""
+
+    def __init__(self, buffer_size: int = DEFAULT_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self._subscribers: dict[int, set[Subscription]] = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def subscribe(self, flow_id: int) -> Subscription:
+        """Register a subscriber for `flow_id`. Must be called from the event loop."""
+        sub = Subscription(self, flow_id, asyncio.get_running_loop(), self.buffer_size)
+        with self._lock:
+            self._subscribers.setdefault(flow_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            subs = self._subscribers.get(sub.flow_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.flow_id]
+
+    def has_subscribers(self, flow_id: int) -> bool:
+        """Whether anyone follows `flow_id`; lets publishers skip building payloads."""
+        with self._lock:
+            return flow_id in self._subscribers
+
+    def publish(self, flow_id: int, event: str, data: dict):
+        """Deliver an event to every current subscriber of `flow_id`. Thread-safe."""
+        with self._lock:
+            subs = list(self._subscribers.get(flow_id, ()))
+        if not subs:
+            return
+        message = {"id": next(self._ids), "event": event, "data": data}
+        for sub in subs:
+            try:
+                sub.loop.call_soon_threadsafe(sub._push, message)
+            except RuntimeError:
+                # Subscriber's loop has shut down; drop it.
+                self.unsubscribe(sub)
+
+
+broker = FlowEventBroker()
+
+
+# ------------------------------------------------------------------
+# EVENT HELPERS
+# ------------------------------------------------------------------
+def task_event(task) -> dict:
+    """Event payload describing a `FlowTask` row."""
+    return {
+        "flow_id": task.flow_id,
+        "task": task.name,
+        "description": task.description,
+        "status": task.status,
+    }
+
+
+def flow_status(flow) -> str:
+    """
+    Derive a flow's overall status from its record and tasks.
+
+    A flow is `completed` once it has produced its related record, `timeout`
+    or `failed` once any task has timed out or failed, and `running` otherwise.
+    """
+    if flow.related_record_id is not None:
+        return "completed"
+    for task in flow.tasks:
+        if task.status in ("failed", "timeout"):
+            return task.status
+    return "running"
+
+
+def end_event(flow, status: str) -> dict:
+    return {"flow_id": flow.id, "status": status, "related_record_id": flow.related_record_id}
+
+
+def format_sse(message: dict) -> str:
+    """Serialize an event as a server-sent event frame."""
+    lines = []
+    if message.get("id") is not None:
+        lines.append(f"id: {message['id']}")
+    lines.append(f"event: {message['event']}")
+    lines.append(f"data: {json.dumps(message['data'])}")
+    return "\n".join(lines) + "\n\n"
@@ -1,14 +1,47 @@
 # flow_manager.py
 import logging
+import time
+from contextvars import ContextVar
 from datetime import datetime
 from functools import wraps
 from sqlalchemy.orm import Session
 
-from models import FlowTask, FlowManager, FlowCondition
+from models import FlowTask, FlowManager, FlowCondition, FlowTaskProfile
+from flow_events import broker, task_event, end_event
+from flow_profiler import TaskProfiler
 
 logger = logging.getLogger("FlowManagerEngine")
 
 
+# ---------------------------------------------------------------------
+# DEADLINES
+# ---------------------------------------------------------------------
+class TaskTimeoutError(Exception):
+    """Raised when a flow task runs past its deadline."""
+
+
+# Absolute `time.monotonic()` deadline of the task currently running in this context
+current_deadline: ContextVar = ContextVar("current_deadline", default=None)
+
+
+def time_remaining():
+    """
+    Seconds left before the running task's deadline, or None if it has none.
+
+    Tasks that block (e.g. waiting on OCR) should bound their waits with this
+    and raise `TaskTimeoutError` when it runs out.
+    """
+    deadline = current_deadline.get()
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+
+def _earliest(*deadlines):
+    pending = [d for d in deadlines if d is not None]
+    return min(pending) if pending else None
+
+
 # ---------------------------------------------------------------------
 # FLOW CREATION UTILITY
 # ---------------------------------------------------------------------
@@ -82,22 +115,77 @@ def create_flow(db: Session, flow_name: str, start_task: str, related_table: str
 class FlowEngine:
     """Manages task execution and updates normalized flow/task tables."""
 
-    def __init__(self, db, flow_obj):
+    def __init__(self, db, flow_obj, timeout: float = None, profile: bool = False):
+        """
+        Args:
+            db (Session): SQLAlchemy session used for task tracking.
+            flow_obj (FlowManager): The flow whose tasks are executed.
+            timeout (float, optional): Budget in seconds for the whole flow,
+                e.g. the time the client is still willing to wait.
+            profile (bool): Profile every task and store a `FlowTaskProfile`
+                per task (see `flow_profiler`).
+        """
         self.db = db
         self.flow = flow_obj
-
-    def flow_task(self, name: str, description: str = None):
-        """Decorator to wrap each task with DB tracking (create row when task starts)."""
+        # Cached: reading attributes of the flow after a commit reloads it
+        self.flow_id = flow_obj.id
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+        self.profile = profile
+
+    def _publish(self, task):
+        """Notify `/flow/{id}/events` subscribers of a committed task status."""
+        # Reading the committed task reloads it, so only do so for a listener
+        if broker.has_subscribers(self.flow_id):
+            broker.publish(self.flow_id, "task", task_event(task))
+
+    def _run(self, profiler, func, args, kwargs):
+        """Run a task body, under `profiler` when profiling is enabled."""
+        if profiler is None:
+            return func(*args, **kwargs)
+        with profiler:
+            return func(*args, **kwargs)
+
+    def _save_profile(self, artifact: dict):
+        # A profile is diagnostic only; failing to store it must not fail the task.
+        if artifact is None:
+            # The profiler itself failed to start; there is nothing to store
+            return
+        try:
+            self.db.add(FlowTaskProfile(flow_id=self.flow_id, **artifact))
+            self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            logger.error(f"❌ Failed to store profile of task '{artifact['task_name']}' (Flow {self.flow_id}): {e}")
+
+    def finish(self, status: str):
+        """Publish the final event for this flow (`completed`, `failed` or `timeout`)."""
+        logger.info(f"🏁 Flow {self.flow_id} finished with status '{status}'.")
+        if broker.has_subscribers(self.flow_id):
+            broker.publish(self.flow_id, "end", end_event(self.flow, status))
+
+    def flow_task(self, name: str, description: str = None, timeout: float = None):
+        """
+        Decorator to wrap each task with DB tracking (create row when task starts).
+
+        The task's deadline is the earlier of `timeout` seconds from its start and
+        the flow deadline. It is exposed to the task through `time_remaining()`;
+        a task that runs out of time raises `TaskTimeoutError` and is marked
+        with status `timeout`, as is a task with its own `timeout` that returns
+        after its deadline.
+        A task whose flow deadline has already passed is not run at all.
+        """
         def decorator(func):
             @wraps(func)
             def wrapper(*args, **kwargs):
-                logger.info(f"▶️ Starting task '{name}' (Flow {self.flow.id})")
+                logger.info(f"▶️ Starting task '{name}' (Flow {self.flow_id})")
+                task_deadline = time.monotonic() + timeout if timeout is not None else None
+                deadline = _earliest(task_deadline, self.deadline)
 
                 # Create the task row IF it doesn't exist yet
-                task = self.db.query(FlowTask).filter_by(flow_id=self.flow.id, name=name).first()
+                task = self.db.query(FlowTask).filter_by(flow_id=self.flow_id, name=name).first()
                 if not task:
                     task = FlowTask(
-                        flow_id=self.flow.id,
+                        flow_id=self.flow_id,
                         name=name,
                         description=description or f"Execute {name}",
                         status="running",                        
@@ -107,20 +195,47 @@ class FlowEngine:
                     task.status = "running"
 
                 self.db.commit()
+                self._publish(task)
 
+                profiler = TaskProfiler(name) if self.profile else None
+                token = current_deadline.set(deadline)
                 try:
-                    result = func(*args, **kwargs)
+                    if deadline is not None and time.monotonic() >= deadline:
+                        raise TaskTimeoutError(f"Flow deadline passed before task '{name}' started.")
+                    result = self._run(profiler, func, args, kwargs)
+                    # Bodies that cannot be interrupted (e.g. in-thread OCR) may overrun.
+                    # Only tasks with their own timeout are checked: those are the
+                    # ones that do bounded, side-effect-free work. A task that has
+                    # committed its result (e.g. save_to_db) must not be reported as failed.
+                    if timeout is not None and deadline is not None and time.monotonic() >= deadline:
+                        raise TaskTimeoutError(f"Task '{name}' ran past its deadline.")
                     task.status = "success"
                     task.end_time = datetime.utcnow()
                     self.db.commit()
+                    self._publish(task)
                     logger.info(f"✅ Task '{name}' succeeded.")
                     return result
+                except TaskTimeoutError as e:
+                    task.status = "timeout"
+                    task.error_message = str(e)
+                    task.end_time = datetime.utcnow()
+                    self.db.commit()
+                    self._publish(task)
+                    logger.error(f"⏱️ Task '{name}' timed out: {e}")
+                    raise
                 except Exception as e:
                     task.status = "failed"
                     task.error_message = str(e)
                     task.end_time = datetime.utcnow()
                     self.db.commit()
+                    self._publish(task)
                     logger.error(f"❌ Task '{name}' failed: {e}")
                     raise
+                finally:
+                    current_deadline.reset(token)
+                    # Stored once the outcome is settled, outside the timed region,
+                    # so profiling cannot push a task past its deadline.
+                    if profiler is not None:
+                        self._save_profile(profiler.artifact)
             return wrapper
         return decorator
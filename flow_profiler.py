@@ -0,0 +1,168 @@
+# flow_profiler.py
+"""
+On-demand profiling of flow tasks.
+
+When profiling is enabled for a flow (per request, or for a sampled fraction
+of flows), `FlowEngine` runs each task under `TaskProfiler`, which records:
+
+  - wall and CPU time of the task,
+  - a cProfile of the task's thread (top functions, plus the full stats for
+    offline analysis with `pstats`),
+  - tracemalloc peak memory and the lines that allocated the most.
+
+The result is stored as a compact `FlowTaskProfile` row per task, linked to
+the flow id, and served by `GET /flow/{flow_id}/profile`.
+
+Only one cProfile can be active per interpreter on Python 3.12+, and the
+tracemalloc peak is process-wide, so concurrent profiled flows may skip the
+CPU profile or report a shared memory peak; both are flagged in the summary.
+The peak is only reset when no other task is being profiled, so a shared peak
+covers every overlapping task's allocations rather than being cut short.
+
+Environment:
+    FLOW_PROFILE_SAMPLE_RATE   Fraction of flows profiled without being asked (default: 0).
+"""
+import cProfile
+import json
+import logging
+import marshal
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+import zlib
+from contextvars import ContextVar
+
+logger = logging.getLogger("FlowManagerEngine")
+
+FLOW_PROFILE_SAMPLE_RATE = float(os.getenv("FLOW_PROFILE_SAMPLE_RATE", "0"))
+TOP_N = 15
+
+# True while a profiled task runs in this context (tasks may then avoid
+# handing work to other threads, where the profiler cannot see it)
+profiling_active: ContextVar = ContextVar("profiling_active", default=False)
+
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+_tracemalloc_owned = False      # False if tracing was already on before we started
+
+
+def should_profile(requested: bool = False) -> bool:
+    """Profile when explicitly requested, or for a sampled fraction of flows."""
+    return requested or (FLOW_PROFILE_SAMPLE_RATE > 0 and random.random() < FLOW_PROFILE_SAMPLE_RATE)
+
+
+def _start_tracemalloc() -> bool:
+    """Start (or join) tracing; returns True if another profiled task is also tracing."""
+    global _tracemalloc_users, _tracemalloc_owned
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0:
+            _tracemalloc_owned = not tracemalloc.is_tracing()
+            if _tracemalloc_owned:
+                tracemalloc.start()
+            # Only when nobody else is tracing: resetting would cut short the
+            # peak of tasks already being profiled.
+            tracemalloc.reset_peak()
+        _tracemalloc_users += 1
+        return _tracemalloc_users > 1
+
+
+def _stop_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0 and _tracemalloc_owned:
+            tracemalloc.stop()
+
+
+class TaskProfiler:
+    """
+    Context manager that profiles one task and builds its artifact.
+
+    Example:
+        >>> with TaskProfiler("extract_details") as prof:
+        ...     extract_task(text)
+        >>> prof.artifact["wall_ms"], prof.artifact["peak_memory_kb"]
+    """
+
+    def __init__(self, task_name: str):
+        self.task_name = task_name
+        self.artifact = None
+        self._profile = None
+
+    def __enter__(self):
+        self._shared_memory = _start_tracemalloc()
+        self._snapshot = tracemalloc.take_snapshot()
+
+        self._profile = cProfile.Profile()
+        try:
+            self._profile.enable()
+        except ValueError:
+            # Another profiler is active (Python 3.12+ allows only one)
+            self._profile = None
+
+        self._token = profiling_active.set(True)
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._profile is not None:
+            self._profile.disable()
+        wall_ms = (time.perf_counter() - self._wall) * 1000
+        cpu_ms = (time.thread_time() - self._cpu) * 1000
+        profiling_active.reset(self._token)
+
+        _, peak = tracemalloc.get_traced_memory()
+        allocations = tracemalloc.take_snapshot().compare_to(self._snapshot, "lineno")
+        _stop_tracemalloc()
+
+        summary = {
+            "cpu_profiled": self._profile is not None,
+            "memory_shared_with_other_flows": self._shared_memory,
+            "top_functions": [],
+            "top_allocations": [
+                {
+                    "location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                    "size_diff_kb": round(stat.size_diff / 1024, 1),
+                    "count_diff": stat.count_diff,
+                }
+                for stat in allocations[:TOP_N]
+            ],
+        }
+        stats_blob = None
+        if self._profile is not None:
+            stats = pstats.Stats(self._profile)
+            summary["top_functions"] = _top_functions(stats)
+            stats_blob = zlib.compress(marshal.dumps(stats.stats))
+
+        self.artifact = {
+            "task_name": self.task_name,
+            "wall_ms": round(wall_ms, 2),
+            "cpu_ms": round(cpu_ms, 2),
+            "peak_memory_kb": round(peak / 1024, 1),
+            "summary": json.dumps(summary),
+            "stats_blob": stats_blob,
+        }
+        return False
+
+
+def _top_functions(stats: pstats.Stats) -> list[dict]:
+    """The TOP_N functions by cumulative time, as plain dicts."""
+    rows = []
+    for (filename, lineno, func), (cc, nc, tt, ct, _) in stats.stats.items():
+        rows.append({
+            "function": f"{os.path.basename(filename)}:{lineno}({func})",
+            "calls": nc,
+            "total_ms": round(tt * 1000, 3),
+            "cumulative_ms": round(ct * 1000, 3),
+        })
+    rows.sort(key=lambda row: row["cumulative_ms"], reverse=True)
+    return rows[:TOP_N]
+
+
+def load_stats_blob(blob: bytes) -> bytes:
+    """Turn a stored stats blob back into a file loadable with `pstats.Stats(path)`."""
+    return zlib.decompress(blob)
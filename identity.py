@@ -0,0 +1,131 @@
+# identity.py
+"""
+Normalization and indexed lookup of identities (name + date of birth).
+
+OCR output is inconsistent: the same person may be read as "MARY  ANN Smith"
+or "Smith, Mary-Ann", born "12/03/1990" or "12 Mar 1990". Records therefore
+also store a normalized name and a real `date` of birth, and matching runs
+against the composite index `ix_ocr_records_identity` on those two columns.
+"""
+import re
+import unicodedata
+from datetime import date, datetime
+
+from sqlalchemy.orm import Session
+
+from models import OCRRecord
+
+_MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "sept": 9, "oct": 10, "nov": 11, "dec": 12,
+}
+_NUMERIC_DOB = re.compile(r"^\s*(\d{1,2})\s*[/\-.]\s*(\d{1,2})\s*[/\-.]\s*(\d{2}|\d{4})\s*$")
+_TEXT_DOB = re.compile(r"^\s*(\d{1,2})\s+([A-Za-z]+)\.?,?\s+(\d{2}|\d{4})\s*$")
+
+
+# ------------------------------------------------------------------
+# NORMALIZATION
+# ------------------------------------------------------------------
+def normalize_name(name: str) -> str:
+    """
+    Reduce a name to a canonical matching key.
+
+    Accents are stripped from Latin letters, case is folded, anything other than
+    letters and marks becomes whitespace and the tokens are sorted, so word order
+    on the document does not matter. Marks of other scripts (e.g. Devanagari
+    vowel signs) are part of the spelling and are kept.
+
+    Example:
+        >>> normalize_name("Smith, Mary-Ánn")
+        'ann mary smith'
+        >>> normalize_name("राम कुमार"), normalize_name("कुमार, राम")
+        ('कुमार राम', 'कुमार राम')
+        >>> normalize_name("राम") == normalize_name("रमा")
+        False
+    """
+    chars, latin_base = [], False
+    for c in unicodedata.normalize("NFKD", name or ""):
+        category = unicodedata.category(c)
+        if category.startswith("M"):
+            if latin_base:
+                continue        # accent on a Latin letter
+        else:
+            latin_base = "LATIN" in unicodedata.name(c, "")
+        chars.append(c if category[0] in "LM" else " ")
+    tokens = unicodedata.normalize("NFC", "".join(chars)).casefold().split()
+    return " ".join(sorted(tokens))
+
+
+def parse_dob(dob: str):
+    """
+    Parse a free-form date of birth into a `date`.
+
+    Numeric dates are read day-first ("12/03/1990" is 12 March 1990), matching
+    the documents we process. Two-digit years are placed in the past century
+    when they would otherwise be in the future.
+
+    Returns:
+        date | None: The parsed date, or None if the string is not a valid date.
+
+    Example:
+        >>> parse_dob("12 Mar 1990"), parse_dob("12-03-90")
+        (datetime.date(1990, 3, 12), datetime.date(1990, 3, 12))
+    """
+    if not dob:
+        return None
+    numeric = _NUMERIC_DOB.match(dob)
+    if numeric:
+        day, month, year = (int(g) for g in numeric.groups())
+        year_digits = len(numeric.group(3))
+    else:
+        text = _TEXT_DOB.match(dob)
+        if not text:
+            return None
+        month = _MONTHS.get(text.group(2).lower()[:4]) or _MONTHS.get(text.group(2).lower()[:3])
+        if month is None:
+            return None
+        day, year = int(text.group(1)), int(text.group(3))
+        year_digits = len(text.group(3))
+
+    if year_digits == 2:
+        this_year = datetime.utcnow().year
+        year += 2000 if 2000 + year <= this_year else 1900
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+# ------------------------------------------------------------------
+# LOOKUP
+# ------------------------------------------------------------------
+def find_identity_matches(db: Session, name: str, dob: str, exclude_id: int = None, limit: int = 20) -> list[OCRRecord]:
+    """
+    Find existing records for the same person (normalized name + date of birth).
+
+    The query is an equality lookup on `ix_ocr_records_identity`, so it stays an
+    index seek regardless of table size. Returns no matches when the DOB cannot
+    be parsed.
+
+    Args:
+        db (Session): SQLAlchemy session.
+        name (str): Name as extracted or entered.
+        dob (str): Date of birth in any supported format.
+        exclude_id (int, optional): Record id to leave out (e.g. the record itself).
+        limit (int): Maximum number of matches to return.
+
+    Returns:
+        list[OCRRecord]: Matching records, newest first.
+    """
+    dob_date = parse_dob(dob)
+    name_key = normalize_name(name)
+    if dob_date is None or not name_key:
+        return []
+
+    query = db.query(OCRRecord).filter(
+        OCRRecord.name_normalized == name_key,
+        OCRRecord.dob_date == dob_date,
+    )
+    if exclude_id is not None:
+        query = query.filter(OCRRecord.id != exclude_id)
+    return query.order_by(OCRRecord.id.desc()).limit(limit).all()
@@ -0,0 +1,366 @@
+# loadtest.py
+"""
+End-to-end load generator for the KYC OCR flow API.
+
+Replays the images in `example_inputs/` against `POST /upload`, mixed with
+`GET /flow/{flow_id}` polling, and reports throughput, latency percentiles,
+error rates and the saturation point for each load step.
+
+The app can be started in-process (backed by a local SQLite database, so no
+outside services are needed) or the generator can be pointed at a running URL.
+
+Usage:
+    # In-process app on SQLite, closed-loop concurrency steps
+    python loadtest.py --concurrency 1,2,4,8 --duration 30
+
+    # Against a running server, open-loop arrival rates (requests/second)
+    python loadtest.py --url http://localhost:8000 --rate 1,2,4 --duration 60
+"""
+import argparse
+import json
+import mimetypes
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_INPUT_DIR = "example_inputs"
+DEFAULT_DB_URL = "sqlite:///./loadtest.db"
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+
+
+# ------------------------------------------------------------------
+# IN-PROCESS SERVER
+# ------------------------------------------------------------------
+def start_local_server(db_url: str, port: int = 0):
+    """
+    Start the FastAPI app in a background thread on a local SQLite database.
+
+    `DATABASE_URL` must be set before `database` is imported, so the app
+    modules are imported here rather than at module level.
+
+    Args:
+        db_url (str): SQLAlchemy URL of the stand-in database.
+        port (int): Port to bind; 0 picks a free port.
+
+    Returns:
+        tuple: (base_url, uvicorn.Server) of the running app.
+    """
+    os.environ["DATABASE_URL"] = db_url
+
+    import uvicorn
+    import models
+    from database import engine
+    from main import app
+
+    models.Base.metadata.create_all(bind=engine)
+
+    if not port:
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="loadtest-server", daemon=True)
+    thread.start()
+
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("In-process server failed to start.")
+        time.sleep(0.05)
+
+    return f"http://127.0.0.1:{port}", server
+
+
+# ------------------------------------------------------------------
+# HTTP CLIENT
+# ------------------------------------------------------------------
+def load_inputs(input_dir: str) -> list[tuple[str, bytes]]:
+    """Read every image in `input_dir` into memory as (filename, bytes)."""
+    images = []
+    for filename in sorted(os.listdir(input_dir)):
+        if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS:
+            with open(os.path.join(input_dir, filename), "rb") as f:
+                images.append((filename, f.read()))
+    if not images:
+        raise ValueError(f"No images found in '{input_dir}'.")
+    return images
+
+
+def encode_multipart(field: str, filename: str, content: bytes) -> tuple[bytes, str]:
+    """Build a multipart/form-data body holding a single file field."""
+    boundary = uuid.uuid4().hex
+    content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    head = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode()
+    tail = f"\r\n--{boundary}--\r\n".encode()
+    return head + content + tail, f"multipart/form-data; boundary={boundary}"
+
+
+def send(request: urllib.request.Request, timeout: float) -> tuple[int, bytes]:
+    """Send a request and return (status, body); HTTP errors are not raised."""
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as resp:
+            return resp.status, resp.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+class Recorder:
+    """Thread-safe collector of per-request samples for one load step."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)   # kind -> [(latency_s, outcome)]
+
+    def add(self, kind: str, latency: float, outcome: str):
+        with self._lock:
+            self.samples[kind].append((latency, outcome))
+
+
+class LoadClient:
+    """Issues upload + flow-polling sequences against the API."""
+
+    def __init__(self, base_url: str, images, polls_per_upload: int, timeout: float):
+        self.base_url = base_url.rstrip("/")
+        self.images = images
+        self.polls_per_upload = polls_per_upload
+        self.timeout = timeout
+
+    def _timed(self, recorder: Recorder, kind: str, request, started: float = None) -> tuple[int, bytes]:
+        # In open-loop runs `started` is the scheduled send time, so time spent
+        # queued behind --max-inflight counts towards latency.
+        started = time.perf_counter() if started is None else started
+        try:
+            status, body = send(request, self.timeout)
+        except Exception:
+            recorder.add(kind, time.perf_counter() - started, "error")
+            return 0, b""
+        if status >= 500:
+            outcome = "error"
+        elif status >= 400:
+            outcome = "rejected"        # flow failed a task (e.g. no text found)
+        else:
+            outcome = "ok"
+        recorder.add(kind, time.perf_counter() - started, outcome)
+        return status, body
+
+    def run_sequence(self, recorder: Recorder, due: float = None):
+        """
+        Upload one random image, then poll its flow `polls_per_upload` times.
+
+        `due` is the `time.perf_counter()` at which the upload was scheduled;
+        upload latency is measured from it (default: now).
+        """
+        filename, content = random.choice(self.images)
+        body, content_type = encode_multipart("file", filename, content)
+        request = urllib.request.Request(
+            f"{self.base_url}/upload", data=body, method="POST",
+            headers={"Content-Type": content_type},
+        )
+        status, payload = self._timed(recorder, "upload", request, started=due)
+
+        flow_id = extract_flow_id(payload)
+        if flow_id is None:
+            return
+        for _ in range(self.polls_per_upload):
+            self._timed(recorder, "poll", urllib.request.Request(f"{self.base_url}/flow/{flow_id}"))
+
+
+def extract_flow_id(payload: bytes):
+    """Pull the flow id out of a success or error response body."""
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    if isinstance(data.get("detail"), dict):
+        data = data["detail"]
+    return data.get("flow_id")
+
+
+# ------------------------------------------------------------------
+# LOAD STEPS
+# ------------------------------------------------------------------
+def run_closed_loop(client: LoadClient, concurrency: int, duration: float) -> Recorder:
+    """Run `concurrency` virtual users back-to-back for `duration` seconds."""
+    recorder = Recorder()
+    stop_at = time.perf_counter() + duration
+
+    def user():
+        while time.perf_counter() < stop_at:
+            client.run_sequence(recorder)
+
+    threads = [threading.Thread(target=user, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return recorder
+
+
+def run_open_loop(client: LoadClient, rate: float, duration: float, max_inflight: int) -> Recorder:
+    """
+    Start a new sequence every 1/`rate` seconds, regardless of completions.
+
+    Latency is measured from each sequence's scheduled start, so waiting for
+    a free slot (at most `max_inflight` in flight) is included rather than
+    hidden (coordinated omission).
+    """
+    recorder = Recorder()
+    interval = 1.0 / rate
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_inflight) as pool:
+        n = 0
+        while True:
+            due = started + n * interval
+            if due - started >= duration:
+                break
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(client.run_sequence, recorder, due)
+            n += 1
+    return recorder
+
+
+# ------------------------------------------------------------------
+# REPORTING
+# ------------------------------------------------------------------
+def percentile(sorted_values: list[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(recorder: Recorder, elapsed: float) -> dict:
+    """Reduce raw samples to throughput, latency percentiles and error rates."""
+    summary = {}
+    for kind, samples in recorder.samples.items():
+        latencies = sorted(lat for lat, _ in samples)
+        outcomes = [o for _, o in samples]
+        total = len(samples)
+        summary[kind] = {
+            "requests": total,
+            "throughput_rps": total / elapsed if elapsed else 0.0,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "error_rate": outcomes.count("error") / total,
+            "rejected_rate": outcomes.count("rejected") / total,
+        }
+    return summary
+
+
+def find_saturation(steps: list[dict], min_gain: float, max_error_rate: float):
+    """
+    Return the last load level before throughput stopped scaling.
+
+    A step is saturated when upload throughput grows by less than `min_gain`
+    (fraction) over the previous step, or its upload error rate exceeds
+    `max_error_rate`. Returns None if every step kept scaling.
+    """
+    previous = None
+    for step in steps:
+        upload = step["stats"].get("upload")
+        if not upload:
+            continue
+        if upload["error_rate"] > max_error_rate:
+            return previous["level"] if previous else step["level"]
+        if previous:
+            prev_rps = previous["stats"]["upload"]["throughput_rps"]
+            if prev_rps and upload["throughput_rps"] < prev_rps * (1 + min_gain):
+                return previous["level"]
+        previous = step
+    return None
+
+
+def print_report(steps: list[dict], mode: str, saturation):
+    unit = "users" if mode == "concurrency" else "req/s"
+    header = f"{mode:>12} {'kind':>7} {'reqs':>6} {'rps':>8} {'p50ms':>8} {'p95ms':>8} {'p99ms':>8} {'err%':>6} {'rej%':>6}"
+    print(header)
+    print("-" * len(header))
+    for step in steps:
+        for kind, s in sorted(step["stats"].items(), reverse=True):
+            print(
+                f"{step['level']:>12g} {kind:>7} {s['requests']:>6} {s['throughput_rps']:>8.2f} "
+                f"{s['p50_ms']:>8.1f} {s['p95_ms']:>8.1f} {s['p99_ms']:>8.1f} "
+                f"{s['error_rate'] * 100:>6.1f} {s['rejected_rate'] * 100:>6.1f}"
+            )
+    if saturation is None:
+        print(f"\nNo saturation reached; try higher load levels ({unit}).")
+    else:
+        print(f"\nSaturation point: {saturation:g} {unit}")
+
+
+# ------------------------------------------------------------------
+# ENTRY POINT
+# ------------------------------------------------------------------
+def parse_levels(value: str) -> list[float]:
+    return [float(v) for v in value.split(",") if v.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the KYC OCR flow API.")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", help="Base URL of a running server (default: start the app in-process).")
+    target.add_argument("--db-url", default=DEFAULT_DB_URL, help="Database URL for the in-process app.")
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument("--concurrency", type=parse_levels, help="Comma-separated virtual-user counts (closed loop).")
+    load.add_argument("--rate", type=parse_levels, help="Comma-separated arrival rates in uploads/s (open loop).")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds per load step.")
+    parser.add_argument("--polls", type=int, default=3, help="GET /flow polls issued after each upload.")
+    parser.add_argument("--inputs", default=DEFAULT_INPUT_DIR, help="Directory of images to replay.")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout in seconds.")
+    parser.add_argument("--max-inflight", type=int, default=256, help="Open-loop cap on in-flight sequences.")
+    parser.add_argument("--min-gain", type=float, default=0.05, help="Throughput gain below which a step counts as saturated.")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="Upload error rate above which a step counts as saturated.")
+    parser.add_argument("--json", dest="json_out", help="Also write the full report to this JSON file.")
+    args = parser.parse_args(argv)
+
+    mode, levels = ("rate", args.rate) if args.rate else ("concurrency", args.concurrency or [1, 2, 4, 8])
+
+    server = None
+    base_url = args.url
+    if not base_url:
+        base_url, server = start_local_server(args.db_url)
+        print(f"Started in-process app at {base_url} ({args.db_url})")
+
+    client = LoadClient(base_url, load_inputs(args.inputs), args.polls, args.timeout)
+    steps = []
+    try:
+        for level in levels:
+            print(f"Running {mode}={level:g} for {args.duration:g}s ...", file=sys.stderr)
+            started = time.perf_counter()
+            if mode == "rate":
+                recorder = run_open_loop(client, level, args.duration, args.max_inflight)
+            else:
+                recorder = run_closed_loop(client, int(level), args.duration)
+            steps.append({"level": level, "stats": summarize(recorder, time.perf_counter() - started)})
+    finally:
+        if server is not None:
+            server.should_exit = True
+
+    saturation = find_saturation(steps, args.min_gain, args.max_error_rate)
+    print_report(steps, mode, saturation)
+
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump({"mode": mode, "steps": steps, "saturation": saturation}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,30 @@
-from fastapi import FastAPI, UploadFile, File, Depends, HTTPException
+import cpu_budget
+
+# The OpenMP / MKL / OpenBLAS runtimes read their thread counts from the
+# environment once, when torch or numpy first loads them, so the budget is
+# applied before anything else is imported.
+cpu_budget.apply_thread_budget()
+
+from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, Request, Query, Header
+from fastapi.responses import StreamingResponse, Response
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from database import get_db
-from models import OCRRecord, FlowManager
-from schemas import OCRResponse, FlowManagerResponse
-from flow_manager import FlowEngine
-import easyocr, os, re, uuid, logging
+from database import get_db, SessionLocal
+from models import OCRRecord, FlowManager, FlowTaskProfile
+from typing import List, Optional
+from schemas import (
+    OCRResponse, FlowManagerResponse, IdentityMatchResponse, FlowProfileResponse, TaskProfileResponse,
+    CPULayoutResponse, OCRBatchingStatsResponse, ReaderPoolStatsResponse,
+)
+from flow_manager import FlowEngine, TaskTimeoutError
+import os, re, uuid, logging, json
 from flow_manager import create_flow
-from tasks import upload_task, ocr_task, extract_task, save_task
+from tasks import upload_task, ocr_task, extract_task, save_task, ocr_batcher, reader_pool
+from reader_pool import parse_languages
+import flow_events
+import flow_profiler
+from identity import find_identity_matches, parse_dob
+from storage import get_store
 # ------------------------------------------------------------------
 # LOGGING CONFIGURATION
 # ------------------------------------------------------------------
@@ -26,14 +44,25 @@ logger = logging.getLogger("FlowManagerApp")
 # ------------------------------------------------------------------
 app = FastAPI(title="KYC Flow Manager", version="4.0")
 
-UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+# Look up existing records with the same name + DOB before saving (see identity.py)
+IDENTITY_CHECK_ON_UPLOAD = os.getenv("IDENTITY_CHECK_ON_UPLOAD", "1").lower() in ("1", "true", "yes")
+
+# Time budgets (seconds). A client may ask for less via the X-Request-Timeout header.
+FLOW_TIMEOUT_SECONDS = float(os.getenv("FLOW_TIMEOUT_SECONDS", "60"))
+OCR_TASK_TIMEOUT_SECONDS = float(os.getenv("OCR_TASK_TIMEOUT_SECONDS", "30"))
 
 # ------------------------------------------------------------------
 # MAIN UPLOAD ENDPOINT
 # ------------------------------------------------------------------
 @app.post("/upload", response_model=OCRResponse)
-async def upload_image(file: UploadFile = File(...), db: Session = Depends(get_db)):
+def upload_image(
+    file: UploadFile = File(...),
+    lang: Optional[str] = Query(None, description='OCR languages, e.g. "hi,en", or "auto" to detect'),
+    profile: bool = Query(False, description="Profile every task of this flow"),
+    x_request_timeout: Optional[float] = Header(None, gt=0),
+    x_profile: bool = Header(False),
+    db: Session = Depends(get_db),
+):
     """
     Handle OCR-based KYC document upload and automated data extraction workflow.
 
@@ -47,25 +76,52 @@ async def upload_image(file: UploadFile = File(...), db: Session = Depends(get_d
     Each task’s success or failure determines whether the next task executes.
     If any task fails, the flow stops gracefully and logs the error.
 
+    The endpoint is synchronous so FastAPI runs it in its threadpool: OCR work
+    does not block the event loop that serves `/flow/{flow_id}/events` streams.
+
+    The flow runs within a time budget: `FLOW_TIMEOUT_SECONDS`, or the client's
+    `X-Request-Timeout` if that is shorter. OCR additionally has its own limit
+    (`OCR_TASK_TIMEOUT_SECONDS`). A task that runs out of time is marked
+    `timeout` and the flow stops.
+
     Args:
         file (UploadFile): The uploaded image file from the request body.
+        lang (str, optional): Comma-separated EasyOCR language codes, or "auto" to
+                              detect them from a quick first pass. Defaults to English.
+                              Must be one of `OCR_ALLOWED_LANGUAGE_SETS`.
+        profile (bool): Profile every task of this flow (same as the `X-Profile: 1` header).
+                        Flows are also sampled at `FLOW_PROFILE_SAMPLE_RATE`.
+                        Results are served by GET /flow/{flow_id}/profile.
+        x_request_timeout (float, optional): Seconds the client is willing to wait.
+        x_profile (bool): Header form of `profile`.
         db (Session): Active SQLAlchemy database session (injected via dependency).
 
     Returns:
         OCRResponse: The final OCR extraction result including name, date of birth,
-                     image name, and flow reference ID.
+                     image name, flow reference ID and the IDs of existing records
+                     for the same person (when `IDENTITY_CHECK_ON_UPLOAD` is on).
 
     Raises:
-        HTTPException(400): If file validation (type or size) fails.
+        HTTPException(400): If file validation (type or size) fails, or `lang`
+                            is not an allowed language set.
         HTTPException(500): If any task in the OCR flow fails unexpectedly.
+        HTTPException(504): If a task runs past its deadline.
 
     Example:
-        curl -X POST "http://localhost:8000/upload" \
+        curl -X POST "http://localhost:8000/upload?lang=auto" \
              -F "file=@/path/to/id_card.jpg"
     """
 
     logger.info("🔄 Starting new OCR flow execution.")
 
+    try:
+        languages = parse_languages(lang)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    flow_engine = None
+    flow_status = "failed"
+    image_key = None
     try:
         # 1️⃣ Initialize new flow record
         flow = create_flow(
@@ -77,44 +133,52 @@ async def upload_image(file: UploadFile = File(...), db: Session = Depends(get_d
         )
 
         # 3️⃣ Initialize flow engine
-        flow_engine = FlowEngine(db, flow)
+        budget = min(FLOW_TIMEOUT_SECONDS, x_request_timeout or FLOW_TIMEOUT_SECONDS)
+        profiled = flow_profiler.should_profile(profile or x_profile)
+        flow_engine = FlowEngine(db, flow, timeout=budget, profile=profiled)
 
         # ---------------- Task Definitions ----------------
 
-         # Step 2: Initialize engine for tracking
-        flow_engine = FlowEngine(db, flow)
-
         # Step 3: Decorate task executions dynamically
         @flow_engine.flow_task("upload_image", description="Task-1 Save uploaded file")
         def run_upload():
-            return upload_task(file)
+            return upload_task(db, file)
 
-        @flow_engine.flow_task("perform_ocr", description="Task-2 Run EasyOCR")
-        def run_ocr(file_path):
-            return ocr_task(file_path)
+        @flow_engine.flow_task("perform_ocr", description="Task-2 Run EasyOCR", timeout=OCR_TASK_TIMEOUT_SECONDS)
+        def run_ocr(image_key):
+            return ocr_task(image_key, languages)
 
         @flow_engine.flow_task("extract_details", description="Task-3 Extract name & DoB")
         def run_extract(text):
             return extract_task(text)
 
+        duplicate_ids = []
+
+        def record_duplicates(matches):
+            duplicate_ids.extend(m.id for m in matches)
+            logger.warning(f"👥 Flow {flow.id}: identity already on file in records {duplicate_ids}")
+
         @flow_engine.flow_task("save_to_db", description="Task-4 Save record to DB")
-        def run_save(name, dob, file_path):
-            return save_task(db, flow, name, dob, file_path)
+        def run_save(name, dob, image_key):
+            hook = record_duplicates if IDENTITY_CHECK_ON_UPLOAD else None
+            return save_task(db, flow, name, dob, image_key, on_duplicates=hook)
         
         # ---------------- Execute Flow ----------------
         # Step 4: Execute the flow sequentially
-        file_path = run_upload()
-        text = run_ocr(file_path)
+        image_key = run_upload()
+        text = run_ocr(image_key)
         name, dob = run_extract(text)
-        record = run_save(name, dob, file_path)
+        record = run_save(name, dob, image_key)
 
         logger.info(f"✅ Flow {flow.id} completed successfully.")
+        flow_status = "completed"
         return OCRResponse(
             id=record.id,
             name=record.name,
             dob=record.dob,
             image_name=record.image_name,
             flow_id=flow.id,
+            duplicate_record_ids=duplicate_ids,
         )
 
     except HTTPException as e:
@@ -122,6 +186,12 @@ async def upload_image(file: UploadFile = File(...), db: Session = Depends(get_d
         logger.error(f"⚠️ Flow {flow.id} validation failed: {e.detail}")
         raise HTTPException(status_code=e.status_code, detail={"error": e.detail,"flow_id": flow.id })
 
+    except TaskTimeoutError as e:
+        # Deadline passed; the overdue work has been cancelled
+        logger.error(f"⏱️ Flow {flow.id} timed out: {e}")
+        flow_status = "timeout"
+        raise HTTPException(status_code=504, detail={"error": str(e), "flow_id": flow.id})
+
     except ValueError as e:
         # Known logical/validation failure
         logger.error(f"❌ Flow {flow.id} failed: {e}")
@@ -132,6 +202,28 @@ async def upload_image(file: UploadFile = File(...), db: Session = Depends(get_d
         logger.exception(f"💥 Unhandled error in Flow {flow.id}: {e}")
         raise HTTPException(status_code=500, detail="Unexpected server error occurred.")
 
+    finally:
+        if image_key is not None and flow_status != "completed":
+            _release_upload(db, flow, image_key)
+        if flow_engine is not None:
+            flow_engine.finish(flow_status)
+
+
+def _release_upload(db: Session, flow: FlowManager, image_key: str):
+    """
+    Release a failed flow's reference to its stored upload (see storage.py).
+
+    Defensive: if the record was saved after all (the flow failed only after
+    its commit), the record keeps the reference.
+    """
+    try:
+        db.rollback()
+        if flow.related_record_id is not None:
+            return
+        get_store().release(db, image_key)
+    except Exception as e:
+        logger.error(f"⚠️ Could not release stored upload {image_key}: {e}")
+
 # ------------------------------------------------------------------
 # FLOW RETRIEVAL
 # ------------------------------------------------------------------
@@ -162,3 +254,255 @@ def get_flow(flow_id: int, db: Session = Depends(get_db)):
     if not flow:
         raise HTTPException(status_code=404, detail="Flow not found")
     return flow
+
+
+# ------------------------------------------------------------------
+# FLOW PROFILE
+# ------------------------------------------------------------------
+@app.get("/flow/{flow_id}/profile", response_model=FlowProfileResponse)
+def get_flow_profile(
+    flow_id: int,
+    task: Optional[str] = Query(None, description="Download the raw pstats file of this task"),
+    db: Session = Depends(get_db),
+):
+    """
+    Retrieve the per-task profiles recorded for a profiled flow.
+
+    Each task reports wall and CPU time, tracemalloc peak memory, its top
+    functions by cumulative time and top allocating lines. With `task=<name>`
+    the full cProfile stats of that task are returned as a file for offline
+    analysis (`python -m pstats flow-12-perform_ocr.pstats`).
+
+    Args:
+        flow_id (int): The unique identifier of the flow.
+        task (str, optional): Task name whose raw pstats file to download.
+        db (Session): Active SQLAlchemy database session (injected via dependency).
+
+    Returns:
+        FlowProfileResponse: The task profiles in execution order, or the pstats
+                             file when `task` is given.
+
+    Raises:
+        HTTPException(404): If the flow does not exist, was not profiled, or has
+                            no CPU profile for the requested task.
+
+    Example:
+        curl -X GET "http://localhost:8000/flow/12/profile"
+        curl -o ocr.pstats "http://localhost:8000/flow/12/profile?task=perform_ocr"
+    """
+    if not db.query(FlowManager.id).filter(FlowManager.id == flow_id).first():
+        raise HTTPException(status_code=404, detail="Flow not found")
+
+    profiles = (
+        db.query(FlowTaskProfile)
+        .filter(FlowTaskProfile.flow_id == flow_id)
+        .order_by(FlowTaskProfile.id)
+        .all()
+    )
+    if not profiles:
+        raise HTTPException(status_code=404, detail="No profile recorded for this flow")
+
+    if task is not None:
+        match = next((p for p in profiles if p.task_name == task and p.stats_blob), None)
+        if match is None:
+            raise HTTPException(status_code=404, detail=f"No CPU profile recorded for task '{task}'")
+        return Response(
+            content=flow_profiler.load_stats_blob(match.stats_blob),
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": f'attachment; filename="flow-{flow_id}-{task}.pstats"'},
+        )
+
+    return FlowProfileResponse(
+        flow_id=flow_id,
+        tasks=[
+            TaskProfileResponse(
+                task_name=p.task_name,
+                wall_ms=p.wall_ms,
+                cpu_ms=p.cpu_ms,
+                peak_memory_kb=p.peak_memory_kb,
+                created_at=p.created_at,
+                has_pstats=p.stats_blob is not None,
+                summary=json.loads(p.summary),
+            )
+            for p in profiles
+        ],
+    )
+
+
+# ------------------------------------------------------------------
+# IDENTITY LOOKUP
+# ------------------------------------------------------------------
+@app.get("/identity/matches", response_model=List[IdentityMatchResponse])
+def get_identity_matches(
+    name: str = Query(..., min_length=1),
+    dob: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+):
+    """
+    Find existing OCR records for the same person.
+
+    Name and date of birth are normalized (see `identity.py`) so that e.g.
+    "Smith, Mary" / "12 Mar 1990" matches "MARY SMITH" / "12/03/1990". The
+    lookup is an index seek on `ix_ocr_records_identity`.
+
+    Args:
+        name (str): Name to look up.
+        dob (str): Date of birth in any supported format.
+        limit (int): Maximum number of matches to return.
+        db (Session): Active SQLAlchemy database session (injected via dependency).
+
+    Returns:
+        List[IdentityMatchResponse]: Matching records, newest first.
+
+    Raises:
+        HTTPException(400): If the date of birth cannot be parsed.
+
+    Example:
+        curl -G "http://localhost:8000/identity/matches" \
+             --data-urlencode "name=Mary Smith" --data-urlencode "dob=12 Mar 1990"
+    """
+    if parse_dob(dob) is None:
+        raise HTTPException(status_code=400, detail=f"Unrecognized date of birth: {dob}")
+    return find_identity_matches(db, name, dob, limit=limit)
+
+
+# ------------------------------------------------------------------
+# FLOW EVENT STREAM
+# ------------------------------------------------------------------
+SSE_HEARTBEAT_SECONDS = 15
+
+
+def _flow_snapshot(flow_id: int):
+    """Load a flow's current task events and overall status, or None if missing."""
+    # A short-lived session rather than `get_db`: the stream outlives the
+    # snapshot, and must not hold a pooled connection while it is open.
+    with SessionLocal() as db:
+        flow = db.query(FlowManager).filter(FlowManager.id == flow_id).first()
+        if not flow:
+            return None
+        status = flow_events.flow_status(flow)
+        events = [{"event": "task", "data": flow_events.task_event(t)} for t in flow.tasks]
+        if status in flow_events.TERMINAL_STATUSES:
+            events.append({"event": "end", "data": flow_events.end_event(flow, status)})
+        return status, events
+
+
+@app.get("/flow/{flow_id}/events")
+async def stream_flow_events(flow_id: int, request: Request):
+    """
+    Stream a flow's task transitions as server-sent events.
+
+    On connect, the current state of every task is replayed as `task` events.
+    Further `task` events follow as `FlowEngine` updates task status, and a
+    final `end` event (status `completed`, `failed` or `timeout`) closes the stream.
+
+    Events are published in-process. When the flow runs on another worker, the
+    stream still terminates: the flow's state is re-read from the database on
+    every heartbeat (every 15 seconds of inactivity).
+
+    Args:
+        flow_id (int): The unique identifier of the flow to follow.
+        request (Request): Used to detect client disconnects.
+
+    Returns:
+        StreamingResponse: A `text/event-stream` of `task` and `end` events.
+
+    Raises:
+        HTTPException(404): If no flow with the given ID exists.
+
+    Example:
+        curl -N "http://localhost:8000/flow/12/events"
+    """
+    # Subscribe before taking the snapshot so no transition falls in between.
+    sub = flow_events.broker.subscribe(flow_id)
+    snapshot = await run_in_threadpool(_flow_snapshot, flow_id)
+    if snapshot is None:
+        sub.close()
+        raise HTTPException(status_code=404, detail="Flow not found")
+
+    async def event_stream():
+        try:
+            status, events = snapshot
+            for message in events:
+                yield flow_events.format_sse(message)
+            if status in flow_events.TERMINAL_STATUSES:
+                return
+
+            while not await request.is_disconnected():
+                message = await sub.get(timeout=SSE_HEARTBEAT_SECONDS)
+                if message is not None:
+                    yield flow_events.format_sse(message)
+                    if message["event"] == "end":
+                        return
+                    continue
+
+                yield ": heartbeat\n\n"
+                snapshot_now = await run_in_threadpool(_flow_snapshot, flow_id)
+                if snapshot_now is None:
+                    # Flow was deleted while being followed
+                    return
+                status, events = snapshot_now
+                if status in flow_events.TERMINAL_STATUSES:
+                    yield flow_events.format_sse(events[-1])
+                    return
+        finally:
+            sub.close()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# ------------------------------------------------------------------
+# DIAGNOSTICS
+# ------------------------------------------------------------------
+@app.get("/diagnostics/cpu", response_model=CPULayoutResponse)
+def get_cpu_layout():
+    """
+    Report the CPU thread budget applied to the worker serving this request.
+
+    Each worker owns a share of the node's cores (see `cpu_budget`). Repeated
+    calls may land on different workers; compare `worker_index` and `cpus`
+    across responses to check the layout has no overlap.
+
+    Example:
+        curl -X GET "http://localhost:8000/diagnostics/cpu"
+    """
+    return cpu_budget.get_layout()
+
+
+@app.get("/diagnostics/ocr-batching", response_model=OCRBatchingStatsResponse)
+def get_ocr_batching_stats():
+    """
+    Report micro-batching metrics for OCR calls on the worker serving this request.
+
+    Includes the batch-size histogram, mean/p95 time requests waited for a batch,
+    and mean batch execution time, for tuning `OCR_BATCH_MAX_SIZE` and
+    `OCR_BATCH_WAIT_MS`.
+
+    Example:
+        curl -X GET "http://localhost:8000/diagnostics/ocr-batching"
+    """
+    if ocr_batcher is None:
+        return OCRBatchingStatsResponse(enabled=False)
+    return OCRBatchingStatsResponse(enabled=True, **ocr_batcher.stats())
+
+
+@app.get("/diagnostics/readers", response_model=ReaderPoolStatsResponse)
+def get_reader_pool_stats():
+    """
+    Report the OCR readers loaded on the worker serving this request.
+
+    Lists each resident language set (most recently used first) with its
+    estimated memory, against the `OCR_READER_POOL_MAX_MB` cap. With
+    `OCR_ISOLATION=process` the readers live in the OCR worker processes and
+    are not listed here.
+
+    Example:
+        curl -X GET "http://localhost:8000/diagnostics/readers"
+    """
+    if reader_pool is None:
+        return ReaderPoolStatsResponse(enabled=False)
+    return ReaderPoolStatsResponse(enabled=True, **reader_pool.stats())
@@ -0,0 +1,170 @@
+# micro_batcher.py
+"""
+Adaptive micro-batching of concurrent single-item requests.
+
+Concurrent callers each submit one item. A background thread collects the
+items that arrive within a short window (or until the batch is full), runs
+them through one batched call, and hands each caller back its own result.
+
+The window adapts to load: it is only waited out when requests are arriving
+fast enough to fill it. Under light traffic (average gap between arrivals
+longer than the window) each item is dispatched immediately, so batching
+adds no latency when there is nothing to batch with.
+"""
+import logging
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+logger = logging.getLogger("FlowManagerApp")
+
+_EWMA_ALPHA = 0.2
+_WAIT_SAMPLES = 1000
+
+
+class MicroBatcher:
+    """
+    Groups single-item calls into batched calls of `batch_fn`.
+
+    Args:
+        batch_fn: Called with a list of items; must return a list of results in
+            the same order. A result that is an Exception instance is raised
+            to that item's caller only.
+        max_batch_size (int): Dispatch as soon as this many items are queued.
+        max_wait_ms (float): Longest an item waits for companions.
+        name (str): Name of the dispatcher thread (also used in logs).
+
+    Example:
+        >>> batcher = MicroBatcher(lambda xs: [x * 2 for x in xs], max_batch_size=8, max_wait_ms=20)
+        >>> batcher(21)
+        42
+    """
+
+    def __init__(self, batch_fn, max_batch_size: int = 8, max_wait_ms: float = 20.0, name: str = "micro-batcher"):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.name = name
+
+        self._queue: queue.Queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._last_arrival = None
+        self._interarrival = None          # EWMA of seconds between submissions
+        self._batches = 0
+        self._items = 0
+        self._size_histogram = Counter()
+        self._waits = deque(maxlen=_WAIT_SAMPLES)
+        self._batch_seconds = 0.0
+
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    # --------------------------------------------------------------
+    # SUBMISSION
+    # --------------------------------------------------------------
+    def submit(self, item) -> Future:
+        """Queue `item` for the next batch and return a future for its result."""
+        now = time.perf_counter()
+        with self._stats_lock:
+            if self._last_arrival is not None:
+                gap = now - self._last_arrival
+                self._interarrival = gap if self._interarrival is None else (
+                    _EWMA_ALPHA * gap + (1 - _EWMA_ALPHA) * self._interarrival
+                )
+            self._last_arrival = now
+        future = Future()
+        self._queue.put((item, future, now))
+        return future
+
+    def __call__(self, item, timeout: float = None):
+        """
+        Submit `item` and block until its result is ready.
+
+        Raises:
+            TimeoutError: If the result is not ready within `timeout` seconds.
+                An item still waiting in the queue is dropped from its batch.
+        """
+        future = self.submit(item)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise TimeoutError(f"{self.name}: no result within {timeout:.1f}s")
+
+    # --------------------------------------------------------------
+    # DISPATCH LOOP
+    # --------------------------------------------------------------
+    def _window(self) -> float:
+        with self._stats_lock:
+            return self._window_unlocked()
+
+    def _window_unlocked(self) -> float:
+        # Only wait when arrivals are frequent enough for the window to gather companions.
+        gap = self._interarrival
+        return 0.0 if gap is None or gap >= self.max_wait else self.max_wait
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self._window()
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # Callers that gave up (future cancelled) are skipped.
+            batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            try:
+                results = self.batch_fn([item for item, _, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"{self.name}: batch_fn returned {len(results)} results for {len(batch)} items")
+            except Exception as e:
+                logger.error(f"❌ {self.name}: batch of {len(batch)} failed: {e}")
+                results = [e] * len(batch)
+            elapsed = time.perf_counter() - started
+
+            for (_, future, _), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+            with self._stats_lock:
+                self._batches += 1
+                self._items += len(batch)
+                self._size_histogram[len(batch)] += 1
+                self._waits.extend(started - queued_at for _, _, queued_at in batch)
+                self._batch_seconds += elapsed
+
+    # --------------------------------------------------------------
+    # METRICS
+    # --------------------------------------------------------------
+    def stats(self) -> dict:
+        """Batch-size and wait-time metrics since start-up."""
+        with self._stats_lock:
+            waits = sorted(self._waits)
+            batches = self._batches
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "current_window_ms": self._window_unlocked() * 1000,
+                "queued": self._queue.qsize(),
+                "batches": batches,
+                "items": self._items,
+                "mean_batch_size": self._items / batches if batches else 0.0,
+                "batch_size_histogram": {str(size): count for size, count in sorted(self._size_histogram.items())},
+                "mean_wait_ms": sum(waits) / len(waits) * 1000 if waits else 0.0,
+                "p95_wait_ms": waits[int(0.95 * (len(waits) - 1))] * 1000 if waits else 0.0,
+                "mean_batch_ms": self._batch_seconds / batches * 1000 if batches else 0.0,
+            }
@@ -3,6 +3,9 @@ from sqlalchemy import (
     Integer,
     String,
     Text,
+    Float,
+    LargeBinary,
+    Date,
     DateTime,
     ForeignKey,
     Enum as SAEnum,
@@ -26,7 +29,28 @@ class OCRRecord(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)
     dob = Column(String, nullable=False)
-    image_name = Column(String, nullable=False)
+    image_name = Column(String, nullable=False)          # content key in the upload store
+
+    # matching keys derived from name/dob (see identity.py)
+    name_normalized = Column(String, nullable=True)     # e.g. "ann mary smith"
+    dob_date = Column(Date, nullable=True)              # None if dob is unparseable
+
+    __table_args__ = (
+        Index("ix_ocr_records_identity", "name_normalized", "dob_date"),
+    )
+
+
+class StoredBlob(Base):
+    __tablename__ = "stored_blobs"
+
+    content_key = Column(String, primary_key=True)      # e.g. "ab/cd/abcd...ef" (digest only)
+    size = Column(Integer, nullable=False)
+    extension = Column(String, nullable=True)            # of the first upload, e.g. ".jpg"
+    ref_count = Column(Integer, default=1, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<StoredBlob(key={self.content_key}, refs={self.ref_count})>"
 
 
 class FlowManager(Base):
@@ -58,6 +82,12 @@ class FlowManager(Base):
         cascade="all, delete-orphan",
         passive_deletes=True,
     )
+    profiles = relationship(
+        "FlowTaskProfile",
+        back_populates="flow",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
 
     def __repr__(self):
         return f"<FlowManager(id={self.id}, name={self.flow_name})>"
@@ -114,3 +144,27 @@ class FlowCondition(Base):
 
     def __repr__(self):
         return f"<FlowCondition(flow_id={self.flow_id}, src={self.source_task}, outcome={self.outcome})>"
+
+
+class FlowTaskProfile(Base):
+    __tablename__ = "flow_task_profiles"
+
+    id = Column(Integer, primary_key=True, index=True)
+    flow_id = Column(
+        Integer,
+        ForeignKey("flow_manager.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+    task_name = Column(String, nullable=False)          # e.g. "perform_ocr"
+    wall_ms = Column(Float, nullable=False)
+    cpu_ms = Column(Float, nullable=False)
+    peak_memory_kb = Column(Float, nullable=False)
+    summary = Column(Text, nullable=False)              # JSON: top functions / allocations
+    stats_blob = Column(LargeBinary, nullable=True)     # zlib-compressed marshalled pstats
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    flow = relationship("FlowManager", back_populates="profiles")
+
+    def __repr__(self):
+        return f"<FlowTaskProfile(flow_id={self.flow_id}, task={self.task_name}, wall_ms={self.wall_ms})>"
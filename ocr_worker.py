@@ -0,0 +1,222 @@
+# ocr_worker.py
+"""
+OCR in separate, killable worker processes.
+
+A thread cannot be interrupted in the middle of `reader.readtext`, so a
+pathological image can hold a worker for as long as inference takes. When OCR
+runs in a child process instead, a request whose deadline passes simply kills
+that process; a fresh worker is started in the background to replace it.
+
+Each child applies its own CPU budget (a slice of its parent's share, see
+`cpu_budget`) and keeps its own reader pool (see `reader_pool`), pre-warmed at
+start-up. Workers only become available to callers once pre-warming is done,
+so a respawn never eats into a request's deadline.
+
+A worker is never killed while it is loading a reader, or a language set whose
+load outlasts the OCR timeout could never be loaded. The caller gets its
+timeout; the worker finishes the load, skips the expired image and goes back
+to the pool.
+
+Environment:
+    OCR_READER_LOAD_TIMEOUT_SECONDS  Longest a worker may spend loading readers
+                                     for a request before it is killed (default: 300).
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger("FlowManagerApp")
+
+# torch is not fork-safe once initialised; always start clean interpreters
+_CTX = multiprocessing.get_context("spawn")
+
+# Longest wait (seconds) before restarting a worker that failed to start
+_MAX_RESPAWN_BACKOFF = 60
+OCR_READER_LOAD_TIMEOUT_SECONDS = float(os.getenv("OCR_READER_LOAD_TIMEOUT_SECONDS", "300"))
+
+
+def _worker_main(conn, worker_index: int, workers: int, cpus: list[int]):
+    """
+    Child process entry point: warm a reader pool, then serve OCR requests from `conn`.
+
+    Each request is (langs, image bytes, expires_at). Loading missing readers is
+    announced with "loading"/"loaded" messages; an image whose `expires_at`
+    (wall-clock time) has passed by then is answered "expired" without OCR.
+    """
+    import cpu_budget
+    cpu_budget.apply_thread_budget(worker_index, workers, cpus)
+    cpu_budget.configure_torch()
+
+    import reader_pool
+    pool = reader_pool.pool_from_env()
+    conn.send(("ready", None))
+
+    while True:
+        try:
+            langs, image, expires_at = conn.recv()
+        except EOFError:
+            return
+        try:
+            missing = [key for key in reader_pool.required_language_sets(langs) if not pool.is_loaded(key)]
+            if missing:
+                conn.send(("loading", None))
+                pool.prewarm(missing)
+                conn.send(("loaded", None))
+            if expires_at is not None and time.time() >= expires_at:
+                conn.send(("expired", None))
+                continue
+            conn.send(("ok", reader_pool.readtext(pool, langs, image)))
+        except ValueError as e:
+            # Bad input (undecodable image, unsupported language): the caller's fault
+            conn.send(("invalid", str(e)))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    def __init__(self, index: int, process, conn):
+        self.index = index
+        self.process = process
+        self.conn = conn
+
+    def kill(self):
+        self.process.kill()
+        self.process.join(5)
+        self.conn.close()
+
+
+class OCRProcessPool:
+    """
+    Fixed-size pool of OCR worker processes with per-call timeouts.
+
+    Args:
+        size (int): Number of worker processes.
+        cpus (list[int], optional): CPUs to divide between the workers
+            (default: the CPUs available to the parent).
+    """
+
+    def __init__(self, size: int = 1, cpus: list[int] = None):
+        self.size = max(1, size)
+        self.cpus = cpus
+        self._idle: queue.Queue = queue.Queue()
+        for index in range(self.size):
+            self._spawn(index)
+
+    def _spawn(self, index: int, attempt: int = 0):
+        """
+        Start a worker and hand it to callers once its reader has loaded.
+
+        A worker that dies during start-up is started again after a backoff
+        (1s, 2s, 4s, ... up to a minute), so the pool never shrinks for good.
+        """
+        parent_conn, child_conn = _CTX.Pipe()
+        process = _CTX.Process(
+            target=_worker_main,
+            args=(child_conn, index, self.size, self.cpus),
+            name=f"ocr-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        worker = _Worker(index, process, parent_conn)
+
+        def wait_ready():
+            try:
+                status, _ = worker.conn.recv()
+            except (EOFError, OSError):
+                status = None
+            if status == "ready":
+                self._idle.put(worker)
+                logger.info(f"🧵 OCR worker {index} ready (pid {process.pid})")
+            else:
+                worker.kill()
+                delay = min(_MAX_RESPAWN_BACKOFF, 2 ** attempt)
+                logger.error(
+                    f"❌ OCR worker {index} exited during start-up (code {process.exitcode}); "
+                    f"retrying in {delay}s"
+                )
+                time.sleep(delay)
+                self._spawn(index, attempt + 1)
+
+        threading.Thread(target=wait_ready, name=f"ocr-worker-{index}-startup", daemon=True).start()
+
+    def _replace(self, worker: _Worker):
+        worker.kill()
+        self._spawn(worker.index)
+
+    def _drain(self, worker: _Worker):
+        """Let a worker that timed out while loading readers finish, then return it to the pool."""
+        try:
+            while True:
+                if not worker.conn.poll(OCR_READER_LOAD_TIMEOUT_SECONDS):
+                    raise TimeoutError
+                status, _ = worker.conn.recv()
+                if status not in ("loading", "loaded"):
+                    break
+        except (TimeoutError, EOFError, OSError):
+            logger.warning(f"⏱️ Killing OCR worker {worker.index} (pid {worker.process.pid}) stuck after a timed-out request")
+            self._replace(worker)
+            return
+        self._idle.put(worker)
+
+    def readtext(self, image: bytes, timeout: float = None, langs=None) -> list:
+        """
+        Run OCR on `image` in a worker process.
+
+        `langs` is None (default set), "auto" or a language set; see `reader_pool`.
+
+        Raises:
+            TimeoutError: If no worker became free, or OCR did not finish,
+                within `timeout` seconds. A worker that was running the image
+                is killed and replaced; one still loading readers is left to
+                finish the load.
+            ValueError: If the image or language set was rejected.
+            RuntimeError: If OCR failed or the worker died.
+        """
+        started = time.monotonic()
+        if timeout is not None and timeout <= 0:
+            raise TimeoutError("No time left for OCR.")
+        try:
+            worker = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No OCR worker became free within {timeout:.1f}s.")
+
+        deadline = None if timeout is None else started + timeout
+        expires_at = None if deadline is None else time.time() + (deadline - time.monotonic())
+        loading = finished = False
+        try:
+            worker.conn.send((langs, image, expires_at))
+            while True:
+                remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+                if not worker.conn.poll(remaining):
+                    break
+                status, payload = worker.conn.recv()
+                if status in ("loading", "loaded"):
+                    loading = status == "loading"
+                    continue
+                finished = True
+                break
+        except (EOFError, OSError) as e:
+            self._replace(worker)
+            raise RuntimeError(f"OCR worker {worker.index} died: {e}")
+
+        if not finished:
+            if loading:
+                logger.warning(f"⏱️ OCR worker {worker.index} still loading readers after {timeout:.1f}s; letting it finish")
+                threading.Thread(target=self._drain, args=(worker,), name=f"ocr-worker-{worker.index}-drain", daemon=True).start()
+            else:
+                logger.warning(f"⏱️ Killing OCR worker {worker.index} (pid {worker.process.pid}) after {timeout:.1f}s")
+                self._replace(worker)
+            raise TimeoutError(f"OCR did not finish within {timeout:.1f}s.")
+
+        self._idle.put(worker)
+        if status == "expired":
+            raise TimeoutError(f"OCR did not finish within {timeout:.1f}s.")
+        if status == "invalid":
+            raise ValueError(payload)
+        if status != "ok":
+            raise RuntimeError(payload)
+        return payload
@@ -0,0 +1,256 @@
+# reader_pool.py
+"""
+Pool of EasyOCR readers keyed by language set.
+
+Loading a reader takes seconds and hundreds of MB, so readers are loaded
+lazily on first use, kept while there is room, and the least recently used
+ones are evicted once the pool's estimated memory goes over its cap. Commonly
+used sets can be pre-warmed at start-up.
+
+Languages are given per request as a list (e.g. ["hi", "en"]) or as "auto".
+With "auto", a quick first pass picks the best set from a list of candidates:
+text regions are detected once on a downscaled copy of the image, and a few of
+them are recognized by each candidate reader. The set with the highest mean
+confidence wins.
+
+easyocr and torch are imported lazily, so this module can be imported before
+the CPU budget is applied (see `cpu_budget`).
+
+Environment:
+    OCR_READER_POOL_MAX_MB    Cap on the estimated memory of loaded readers (default: 2048).
+    OCR_PREWARM_LANGUAGES     Sets to load at start-up, e.g. "en;hi,en" (default: en).
+    OCR_AUTO_LANGUAGE_SETS    Candidates for "auto" (default: en;hi,en;ar,en;ru,en).
+    OCR_ALLOWED_LANGUAGE_SETS Sets a request may ask for (default: the pre-warmed and
+                              "auto" sets). Anything else is rejected, so clients
+                              cannot make the server load arbitrary models.
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger("FlowManagerApp")
+
+DEFAULT_LANGUAGES = ("en",)
+AUTO = "auto"
+
+# First-pass settings for language detection
+_DETECT_MAX_SIDE = 960
+_DETECT_MAX_BOXES = 8
+# A non-default set must beat the default's confidence by this much to be chosen
+_DETECT_MARGIN = 0.05
+
+
+def language_key(langs) -> tuple:
+    """Canonical, hashable form of a language set."""
+    return tuple(sorted({lang.strip().lower() for lang in langs if lang.strip()})) or DEFAULT_LANGUAGES
+
+
+def parse_language_sets(value: str) -> list[tuple]:
+    """Parse "en;hi,en" into [("en",), ("en", "hi")]."""
+    return [language_key(part.split(",")) for part in (value or "").split(";") if part.strip()]
+
+
+def parse_languages(value: str):
+    """
+    Parse a request's language parameter: None, "auto" or "hi,en".
+
+    Raises:
+        ValueError: If the set is not in `ALLOWED_LANGUAGE_SETS`.
+    """
+    if value is None or not value.strip():
+        return None
+    if value.strip().lower() == AUTO:
+        return AUTO
+    key = language_key(value.split(","))
+    if key not in ALLOWED_LANGUAGE_SETS:
+        allowed = ", ".join(",".join(k) for k in ALLOWED_LANGUAGE_SETS)
+        raise ValueError(f"Unsupported OCR languages '{','.join(key)}'. Allowed: {allowed}, auto")
+    return key
+
+
+def required_language_sets(langs) -> list[tuple]:
+    """Language sets whose readers OCR with `langs` (None, "auto" or a set) may use."""
+    if langs == AUTO:
+        return list(AUTO_LANGUAGE_SETS)
+    return [language_key(langs or DEFAULT_LANGUAGES)]
+
+
+def _reader_memory_mb(reader) -> float:
+    """Estimate a reader's resident size from its model parameters and buffers."""
+    total = 0
+    for model in (getattr(reader, "detector", None), getattr(reader, "recognizer", None)):
+        if model is None:
+            continue
+        for tensor in list(model.parameters()) + list(model.buffers()):
+            total += tensor.numel() * tensor.element_size()
+    return total / (1024 * 1024)
+
+
+class ReaderPool:
+    """
+    Lazily filled, memory-bounded LRU cache of EasyOCR readers.
+
+    Args:
+        max_memory_mb (float): Evict least recently used readers above this
+            estimated total. The most recently requested reader is always kept.
+        factory: Builds a reader from a language list (default: `easyocr.Reader`).
+    """
+
+    def __init__(self, max_memory_mb: float = 2048, factory=None):
+        self.max_memory_mb = max_memory_mb
+        self.factory = factory
+        self._readers: OrderedDict = OrderedDict()    # key -> (reader, memory_mb)
+        self._lock = threading.Lock()
+        self._loading: dict[tuple, threading.Lock] = {}
+        self.loads = 0
+        self.evictions = 0
+
+    def _build(self, key: tuple):
+        if self.factory is not None:
+            return self.factory(list(key))
+        import easyocr
+        return easyocr.Reader(list(key))
+
+    def get(self, langs=DEFAULT_LANGUAGES):
+        """Return the reader for `langs`, loading it (once, even under concurrency) if needed."""
+        key = language_key(langs)
+        with self._lock:
+            if key in self._readers:
+                self._readers.move_to_end(key)
+                return self._readers[key][0]
+            load_lock = self._loading.setdefault(key, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                if key in self._readers:
+                    self._readers.move_to_end(key)
+                    return self._readers[key][0]
+
+            logger.info(f"📚 Loading OCR reader for {list(key)}")
+            reader = self._build(key)
+            memory_mb = _reader_memory_mb(reader)
+
+            with self._lock:
+                self._readers[key] = (reader, memory_mb)
+                self._loading.pop(key, None)
+                self.loads += 1
+                self._evict()
+            return reader
+
+    def _evict(self):
+        # Called with self._lock held. Evicted readers are freed once callers
+        # still using them drop their reference.
+        while len(self._readers) > 1 and self.memory_mb() > self.max_memory_mb:
+            key, (_, memory_mb) = self._readers.popitem(last=False)
+            self.evictions += 1
+            logger.info(f"♻️ Evicted OCR reader for {list(key)} ({memory_mb:.0f} MB)")
+
+    def is_loaded(self, langs) -> bool:
+        with self._lock:
+            return language_key(langs) in self._readers
+
+    def memory_mb(self) -> float:
+        return sum(memory_mb for _, memory_mb in self._readers.values())
+
+    def prewarm(self, language_sets):
+        """Load the given language sets up front."""
+        for langs in language_sets:
+            self.get(langs)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_memory_mb": self.max_memory_mb,
+                "memory_mb": round(self.memory_mb(), 1),
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "readers": [
+                    {"languages": list(key), "memory_mb": round(memory_mb, 1)}
+                    for key, (_, memory_mb) in reversed(self._readers.items())
+                ],
+            }
+
+
+PREWARM_LANGUAGE_SETS = parse_language_sets(os.getenv("OCR_PREWARM_LANGUAGES", "en"))
+AUTO_LANGUAGE_SETS = parse_language_sets(os.getenv("OCR_AUTO_LANGUAGE_SETS", "en;hi,en;ar,en;ru,en"))
+ALLOWED_LANGUAGE_SETS = parse_language_sets(os.getenv("OCR_ALLOWED_LANGUAGE_SETS")) or list(
+    dict.fromkeys([DEFAULT_LANGUAGES, *PREWARM_LANGUAGE_SETS, *AUTO_LANGUAGE_SETS])
+)
+
+
+def pool_from_env() -> ReaderPool:
+    """Build a pool configured from the environment and pre-warm it."""
+    pool = ReaderPool(float(os.getenv("OCR_READER_POOL_MAX_MB", "2048")))
+    pool.prewarm(PREWARM_LANGUAGE_SETS)
+    return pool
+
+
+# ------------------------------------------------------------------
+# LANGUAGE DETECTION
+# ------------------------------------------------------------------
+def detect_languages(pool: ReaderPool, image, candidates: list[tuple] = None) -> tuple:
+    """
+    Pick the language set that reads `image` (an RGB array) most confidently.
+
+    Text regions are detected once, with the first candidate's reader, on a
+    copy downscaled to at most 960 px; the first few regions are then
+    recognized by every candidate reader.
+
+    Returns:
+        tuple: The chosen language key (the first candidate if no text is found).
+    """
+    import cv2
+
+    candidates = candidates or AUTO_LANGUAGE_SETS
+    default = candidates[0]
+
+    scale = _DETECT_MAX_SIDE / max(image.shape[:2])
+    if scale < 1:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    grey = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+
+    horizontal, free = pool.get(default).detect(image)
+    horizontal, free = horizontal[0][:_DETECT_MAX_BOXES], free[0][:_DETECT_MAX_BOXES]
+    if not horizontal and not free:
+        return default
+
+    scores = {}
+    for langs in candidates:
+        results = pool.get(langs).recognize(grey, horizontal, free)
+        scores[langs] = sum(conf for _, _, conf in results) / len(results) if results else 0.0
+
+    best = max(candidates, key=lambda langs: scores[langs])
+    if scores[best] < scores[default] + _DETECT_MARGIN:
+        best = default
+    logger.info(f"🌐 Detected languages {list(best)} (scores: { {','.join(k): round(v, 3) for k, v in scores.items()} })")
+    return best
+
+
+def resolve_languages(pool: ReaderPool, langs, image) -> tuple:
+    """Turn a request's language choice (None, "auto" or a set) into a concrete key."""
+    if langs is None:
+        return DEFAULT_LANGUAGES
+    if langs == AUTO:
+        return detect_languages(pool, image)
+    return language_key(langs)
+
+
+# ------------------------------------------------------------------
+# SINGLE-IMAGE OCR
+# ------------------------------------------------------------------
+def decode_image(data: bytes):
+    """Decode image bytes to an RGB array (as easyocr does for bytes input)."""
+    import cv2
+    import numpy as np
+
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Could not decode image for OCR.")
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def readtext(pool: ReaderPool, langs, data: bytes) -> list:
+    """OCR one image with the reader for `langs` (None, "auto" or a language set)."""
+    image = decode_image(data)
+    return pool.get(resolve_languages(pool, langs, image)).readtext(image)
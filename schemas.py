@@ -1,6 +1,6 @@
 from pydantic import BaseModel
-from typing import List, Optional
-from datetime import datetime
+from typing import Any, Dict, List, Optional
+from datetime import date, datetime
 
 
 # ---------------------------------------------------------------------
@@ -12,10 +12,25 @@ class OCRResponse(BaseModel):
     dob: str
     image_name: str
     flow_id: Optional[int] = None  
+    duplicate_record_ids: List[int] = []
     class Config:
         from_attributes = True  
 
 
+# ---------------------------------------------------------------------
+# IDENTITY MATCH SCHEMA
+# ---------------------------------------------------------------------
+class IdentityMatchResponse(BaseModel):
+    id: int
+    name: str
+    dob: str
+    dob_date: Optional[date] = None
+    image_name: str
+
+    class Config:
+        from_attributes = True
+
+
 # ---------------------------------------------------------------------
 # FLOW TASK SCHEMA
 # ---------------------------------------------------------------------
@@ -64,3 +79,64 @@ class FlowManagerResponse(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+# ---------------------------------------------------------------------
+# FLOW PROFILE SCHEMAS
+# ---------------------------------------------------------------------
+class TaskProfileResponse(BaseModel):
+    task_name: str
+    wall_ms: float
+    cpu_ms: float
+    peak_memory_kb: float
+    created_at: datetime
+    has_pstats: bool
+    summary: Dict[str, Any]
+
+
+class FlowProfileResponse(BaseModel):
+    flow_id: int
+    tasks: List[TaskProfileResponse] = []
+
+# ---------------------------------------------------------------------
+# DIAGNOSTICS SCHEMAS
+# ---------------------------------------------------------------------
+class CPULayoutResponse(BaseModel):
+    pid: int
+    worker_index: int
+    workers: int
+    node_cpus: int
+    cpus: List[int]
+    threads: int
+    pinned: bool
+    torch_threads: Optional[int] = None
+    torch_interop_threads: Optional[int] = None
+
+
+class OCRBatchingStatsResponse(BaseModel):
+    enabled: bool
+    max_batch_size: int = 0
+    max_wait_ms: float = 0.0
+    current_window_ms: float = 0.0
+    queued: int = 0
+    batches: int = 0
+    items: int = 0
+    mean_batch_size: float = 0.0
+    batch_size_histogram: Dict[str, int] = {}
+    mean_wait_ms: float = 0.0
+    p95_wait_ms: float = 0.0
+    mean_batch_ms: float = 0.0
+
+
+class ReaderStatsResponse(BaseModel):
+    languages: List[str]
+    memory_mb: float
+
+
+class ReaderPoolStatsResponse(BaseModel):
+    enabled: bool
+    max_memory_mb: float = 0.0
+    memory_mb: float = 0.0
+    loads: int = 0
+    evictions: int = 0
+    readers: List[ReaderStatsResponse] = []
@@ -0,0 +1,289 @@
+# storage.py
+"""
+Content-addressed storage for uploaded documents.
+
+Uploads are stored under the SHA-256 of their bytes, in sharded
+subdirectories (`ab/cd/abcd...`), so no single directory grows without
+bound and identical re-uploads are stored only once. The key is the digest
+alone, so the same bytes uploaded as `.jpg` and `.png` share one blob; the
+extension of the first upload is kept on the `stored_blobs` row. Each stored blob has a
+row in `stored_blobs` counting the uploads that reference it; the blob is
+deleted when the last reference is released.
+
+Files are written atomically: bytes are streamed (and hashed) into a temp file,
+which is then moved into place, so readers never see a partially written blob.
+
+Backends are pluggable. `LocalFileStorage` (the default) keeps blobs on disk;
+`ObjectStoreStorage` adapts any client implementing `ObjectStoreClient`, and
+`InMemoryObjectStore` is a local stand-in for it.
+
+Environment:
+    STORAGE_BACKEND   "local" (default) or "memory".
+    UPLOAD_DIR        Root directory of the local backend (default: uploads).
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import StoredBlob
+
+logger = logging.getLogger("FlowManagerApp")
+
+CHUNK_SIZE = 1024 * 1024
+
+
+# ------------------------------------------------------------------
+# BACKENDS
+# ------------------------------------------------------------------
+class StorageBackend(ABC):
+    """Where blobs physically live. Keys are relative, '/'-separated paths."""
+
+    def staging_dir(self) -> str:
+        """Directory for temp files; must allow an atomic move into `put_file`."""
+        return tempfile.gettempdir()
+
+    @abstractmethod
+    def exists(self, key: str) -> bool: ...
+
+    @abstractmethod
+    def put_file(self, key: str, src_path: str):
+        """Atomically publish the fully written local file `src_path` under `key`."""
+
+    @abstractmethod
+    def read(self, key: str) -> bytes: ...
+
+    @abstractmethod
+    def delete(self, key: str): ...
+
+
+class LocalFileStorage(StorageBackend):
+    """Blobs on the local filesystem under `root`."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self._staging = os.path.join(root, ".tmp")
+        os.makedirs(self._staging, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    def staging_dir(self) -> str:
+        # Same filesystem as the blobs, so os.replace() is an atomic rename.
+        return self._staging
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def put_file(self, key: str, src_path: str):
+        dest = self.path(key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.replace(src_path, dest)
+
+    def read(self, key: str) -> bytes:
+        with open(self.path(key), "rb") as f:
+            return f.read()
+
+    def delete(self, key: str):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+class ObjectStoreClient(ABC):
+    """Minimal object-store API (a subset of S3 semantics) used by `ObjectStoreStorage`."""
+
+    @abstractmethod
+    def head_object(self, key: str) -> bool: ...
+
+    @abstractmethod
+    def put_object(self, key: str, fileobj): ...
+
+    @abstractmethod
+    def get_object(self, key: str) -> bytes: ...
+
+    @abstractmethod
+    def delete_object(self, key: str): ...
+
+
+class InMemoryObjectStore(ObjectStoreClient):
+    """Process-local object store; a stand-in for a real bucket in tests and load runs."""
+
+    def __init__(self):
+        self._objects: dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def head_object(self, key: str) -> bool:
+        with self._lock:
+            return key in self._objects
+
+    def put_object(self, key: str, fileobj):
+        data = fileobj.read()
+        with self._lock:
+            self._objects[key] = data
+
+    def get_object(self, key: str) -> bytes:
+        with self._lock:
+            return self._objects[key]
+
+    def delete_object(self, key: str):
+        with self._lock:
+            self._objects.pop(key, None)
+
+
+class ObjectStoreStorage(StorageBackend):
+    """Blobs in an object store under an optional key `prefix`."""
+
+    def __init__(self, client: ObjectStoreClient, prefix: str = ""):
+        self.client = client
+        self.prefix = prefix.strip("/")
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def exists(self, key: str) -> bool:
+        return self.client.head_object(self._key(key))
+
+    def put_file(self, key: str, src_path: str):
+        # A single PUT is atomic in object stores; the temp file is just the upload source.
+        try:
+            with open(src_path, "rb") as f:
+                self.client.put_object(self._key(key), f)
+        finally:
+            os.remove(src_path)
+
+    def read(self, key: str) -> bytes:
+        return self.client.get_object(self._key(key))
+
+    def delete(self, key: str):
+        self.client.delete_object(self._key(key))
+
+
+# ------------------------------------------------------------------
+# CONTENT STORE
+# ------------------------------------------------------------------
+_EXTENSION_ALIASES = {".jpeg": ".jpg"}
+
+
+def _canonical_extension(ext: str) -> str:
+    ext = (ext or "").lower()
+    return _EXTENSION_ALIASES.get(ext, ext)
+
+
+class ContentStore:
+    """Deduplicating, reference-counted, content-addressed store over a backend."""
+
+    def __init__(self, backend: StorageBackend):
+        self.backend = backend
+
+    @staticmethod
+    def key_for(digest: str) -> str:
+        """Sharded key for a SHA-256 hex digest, e.g. `ab/cd/abcd...ef`."""
+        return f"{digest[:2]}/{digest[2:4]}/{digest}"
+
+    def put(self, db: Session, fileobj, ext: str) -> str:
+        """
+        Store the contents of `fileobj` and take a reference to it.
+
+        The bytes are hashed while they are streamed to a temp file. If a blob
+        with the same content already exists, the temp file is discarded and
+        only the reference count grows.
+
+        Args:
+            db (Session): SQLAlchemy session used for the reference count.
+            fileobj: Readable binary file object positioned at the start.
+            ext (str): File extension, recorded on a newly created blob row (e.g. '.jpg').
+
+        Returns:
+            str: The content key of the stored blob.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.backend.staging_dir(), suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    tmp.write(chunk)
+                    size += len(chunk)
+                tmp.flush()
+                os.fsync(tmp.fileno())
+
+            key = self.key_for(digest.hexdigest())
+            # Reference first, then publish: a concurrent release of the same
+            # key either runs before (and we re-create the blob) or sees our ref.
+            self._add_ref(db, key, size, _canonical_extension(ext))
+            if self.backend.exists(key):
+                logger.info(f"♻️ Duplicate upload, reusing stored blob {key}")
+            else:
+                self.backend.put_file(key, tmp_path)
+            return key
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def read(self, key: str) -> bytes:
+        return self.backend.read(key)
+
+    def release(self, db: Session, key: str) -> bool:
+        """
+        Drop one reference to `key`, deleting the blob when none remain.
+
+        Returns:
+            bool: True if the blob was deleted.
+        """
+        blob = db.query(StoredBlob).filter_by(content_key=key).with_for_update().first()
+        if blob is None:
+            return False
+        blob.ref_count -= 1
+        if blob.ref_count > 0:
+            db.commit()
+            return False
+        db.delete(blob)
+        self.backend.delete(key)
+        db.commit()
+        logger.info(f"🗑️ Deleted stored blob {key} (no references left)")
+        return True
+
+    @staticmethod
+    def _add_ref(db: Session, key: str, size: int, ext: str):
+        increment = {StoredBlob.ref_count: StoredBlob.ref_count + 1}
+        if not db.query(StoredBlob).filter_by(content_key=key).update(increment):
+            try:
+                with db.begin_nested():
+                    db.add(StoredBlob(content_key=key, size=size, extension=ext, ref_count=1))
+            except IntegrityError:
+                # Another upload of the same content inserted the row first.
+                db.query(StoredBlob).filter_by(content_key=key).update(increment)
+        db.commit()
+
+
+# ------------------------------------------------------------------
+# DEFAULT STORE
+# ------------------------------------------------------------------
+BACKENDS = {
+    "local": lambda: LocalFileStorage(os.getenv("UPLOAD_DIR", "uploads")),
+    "memory": lambda: ObjectStoreStorage(InMemoryObjectStore()),
+}
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> ContentStore:
+    """The process-wide content store, built from `STORAGE_BACKEND` on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                name = os.getenv("STORAGE_BACKEND", "local")
+                if name not in BACKENDS:
+                    raise ValueError(f"Unknown STORAGE_BACKEND '{name}'. Available: {sorted(BACKENDS)}")
+                _store = ContentStore(BACKENDS[name]())
+    return _store
@@ -1,23 +1,57 @@
 import os
 import re
-import uuid
 import logging
-import easyocr
+import cpu_budget
+
+# Thread pools are sized from the environment when torch loads, so the
+# budget has to be in place before easyocr (and torch) are imported.
+# `main` applies it first thing; this covers importing tasks on its own.
+if not cpu_budget.get_layout():
+    cpu_budget.apply_thread_budget()
+
+import cv2
 from fastapi import UploadFile, HTTPException
 from sqlalchemy.orm import Session
 from models import OCRRecord, FlowManager
+from storage import get_store
+from identity import normalize_name, parse_dob, find_identity_matches
+from micro_batcher import MicroBatcher
+from ocr_worker import OCRProcessPool
+from reader_pool import pool_from_env, resolve_languages, decode_image
+from flow_manager import TaskTimeoutError, time_remaining
+from flow_profiler import profiling_active
 
 # ------------------------------------------------------------------
 # CONFIG & LOGGER
 # ------------------------------------------------------------------
 
 logger = logging.getLogger("FlowManagerApp")
-reader = easyocr.Reader(["en"])
+cpu_budget.configure_torch()
+
+# "thread": OCR runs in this process (micro-batched; can't be interrupted).
+# "process": OCR runs in killable worker processes, so deadlines are enforced.
+OCR_ISOLATION = os.getenv("OCR_ISOLATION", "thread").lower()
+OCR_PROCESS_WORKERS = int(os.getenv("OCR_PROCESS_WORKERS", "1"))
+
+# Readers are pooled per language set (see reader_pool.py); in process mode
+# each OCR worker process keeps its own pool.
+if OCR_ISOLATION == "process":
+    reader_pool = None
+    ocr_pool = OCRProcessPool(OCR_PROCESS_WORKERS, cpus=cpu_budget.get_layout().get("cpus"))
+else:
+    reader_pool = pool_from_env()
+    ocr_pool = None
 
 ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png"}
 MAX_FILE_SIZE_MB = 1
 
-UPLOAD_DIR = "uploads"
+# Micro-batching of concurrent OCR calls (see micro_batcher.py)
+OCR_BATCHING = os.getenv("OCR_BATCHING", "1").lower() in ("1", "true", "yes")
+OCR_BATCH_MAX_SIZE = int(os.getenv("OCR_BATCH_MAX_SIZE", "8"))
+OCR_BATCH_WAIT_MS = float(os.getenv("OCR_BATCH_WAIT_MS", "20"))
+# Images are padded to a common size to share a batch; cap the wasted area
+OCR_BATCH_MAX_PAD_RATIO = 2.0
+
 # ------------------------------------------------------------------
 # VALIDATION FUNCTIONS
 # ------------------------------------------------------------------
@@ -48,25 +82,132 @@ def validate_file_size(file: UploadFile):
 # ------------------------------------------------------------------
 # TASK FUNCTIONS
 # ------------------------------------------------------------------
-def upload_task(file: UploadFile) -> str:
-    """Validate and save uploaded file."""
+def upload_task(db: Session, file: UploadFile) -> str:
+    """Validate and save uploaded file; returns its content key in the upload store."""
     validate_file_type(file)
     validate_file_size(file)
 
     file_ext = os.path.splitext(file.filename)[1]
-    unique_name = f"{uuid.uuid4().hex}{file_ext}"
-    file_path = os.path.join(UPLOAD_DIR, unique_name)
+    image_key = get_store().put(db, file.file, file_ext)
+
+    logger.info(f"✅ File uploaded successfully: {image_key}")
+    return image_key
+
+
+# ------------------------------------------------------------------
+# BATCHED OCR
+# ------------------------------------------------------------------
+def _padding_groups(images: list, max_ratio: float) -> list[list[int]]:
+    """
+    Group image indexes so each group can be padded to one size cheaply.
+
+    Images are taken in order of area; an image joins the current group while
+    the group's padded size stays within `max_ratio` times the area of its
+    smallest member.
+    """
+    area = lambda i: images[i].shape[0] * images[i].shape[1]
+    groups = []
+    for i in sorted(range(len(images)), key=area):
+        if groups:
+            group = groups[-1]
+            height = max(images[j].shape[0] for j in group + [i])
+            width = max(images[j].shape[1] for j in group + [i])
+            if height * width <= max_ratio * area(group[0]):
+                group.append(i)
+                continue
+        groups.append([i])
+    return groups
+
+
+def _readtext_group(reader, arrays: list) -> list:
+    """OCR images that share a language set, batching those of similar size."""
+    results = [None] * len(arrays)
+    for group in _padding_groups(arrays, OCR_BATCH_MAX_PAD_RATIO):
+        if len(group) == 1:
+            results[group[0]] = reader.readtext(arrays[group[0]])
+            continue
+        # readtext_batched needs equally sized inputs; pad with white (paper) borders
+        height = max(arrays[j].shape[0] for j in group)
+        width = max(arrays[j].shape[1] for j in group)
+        padded = [
+            cv2.copyMakeBorder(
+                arrays[j], 0, height - arrays[j].shape[0], 0, width - arrays[j].shape[1],
+                cv2.BORDER_CONSTANT, value=(255, 255, 255),
+            )
+            for j in group
+        ]
+        for j, result in zip(group, reader.readtext_batched(padded)):
+            results[j] = result
+    return results
+
+
+def _prepare(languages, data: bytes) -> tuple:
+    """
+    Decode an image and pick its reader, loading it (or detecting the
+    languages) first if needed. Runs in the calling request's thread, so a
+    slow reader load never holds up the batch dispatcher.
+
+    Returns:
+        tuple: (reader, RGB image array), ready for `_readtext_batch`.
+    """
+    image = decode_image(data)
+    return reader_pool.get(resolve_languages(reader_pool, languages, image)), image
 
-    with open(file_path, "wb") as f:
-        f.write(file.file.read())
 
-    logger.info(f"✅ File uploaded successfully: {file_path}")
-    return file_path
+def _readtext_batch(items: list[tuple]) -> list:
+    """
+    Run OCR on several (reader, image) items with as few batched reader
+    calls as possible. Items are grouped by reader, i.e. by language set.
+    """
+    results = [None] * len(items)
+    by_reader = {}
+    for i, (reader, image) in enumerate(items):
+        by_reader.setdefault(id(reader), (reader, []))[1].append((i, image))
 
+    for reader, entries in by_reader.values():
+        try:
+            group_results = _readtext_group(reader, [image for _, image in entries])
+        except Exception as e:
+            group_results = [e] * len(entries)
+        for (i, _), result in zip(entries, group_results):
+            results[i] = result
+    return results
 
-def ocr_task(file_path: str) -> str:
-    """Perform OCR on saved image."""
-    results = reader.readtext(file_path)
+
+ocr_batcher = (
+    MicroBatcher(_readtext_batch, OCR_BATCH_MAX_SIZE, OCR_BATCH_WAIT_MS, name="ocr-batcher")
+    if OCR_BATCHING and reader_pool is not None else None
+)
+
+
+def ocr_task(image_key: str, languages=None) -> str:
+    """
+    Perform OCR on a stored image within the running task's deadline.
+
+    `languages` is None (English), "auto" (detected from a quick first pass)
+    or a language set such as ("en", "hi"); see `reader_pool`.
+
+    With `OCR_ISOLATION=process` the worker running an overdue image is killed.
+    Otherwise an image still queued for a batch is dropped, but inference that
+    has already started runs to completion; the task is then marked `timeout`
+    by `FlowEngine` all the same.
+
+    Profiled flows skip the micro-batcher so that decoding, detection and
+    recognition run on the profiled thread.
+    """
+    image = get_store().read(image_key)
+    try:
+        if ocr_pool is not None:
+            results = ocr_pool.readtext(image, time_remaining(), languages)
+        elif ocr_batcher is not None and not profiling_active.get():
+            item = _prepare(languages, image)
+            results = ocr_batcher(item, time_remaining())
+        else:
+            results = _readtext_batch([_prepare(languages, image)])[0]
+            if isinstance(results, Exception):
+                raise results
+    except TimeoutError as e:
+        raise TaskTimeoutError(str(e))
     text = " ".join([res[1] for res in results])
     if not text.strip():
         raise ValueError("No text detected during OCR.")
@@ -95,16 +236,44 @@ def extract_task(text: str):
     return name, dob
 
 
-def save_task(db: Session, flow: FlowManager, name: str, dob: str, file_path: str):
-    """Save OCR results to database."""
+def save_task(db: Session, flow: FlowManager, name: str, dob: str, image_key: str, on_duplicates=None):
+    """
+    Save OCR results to database.
+
+    If `on_duplicates` is given, existing records with the same normalized name
+    and date of birth are looked up first and passed to it when any are found.
+    The hook may raise to reject the record.
+
+    Raises:
+        TaskTimeoutError: If the task's deadline passed before the record was committed.
+    """
+    if on_duplicates is not None:
+        matches = find_identity_matches(db, name, dob)
+        if matches:
+            on_duplicates(matches)
+
+    # Last point at which the flow can still give up cleanly: once the record
+    # is committed, the flow has succeeded whatever the clock says.
+    remaining = time_remaining()
+    if remaining is not None and remaining <= 0:
+        raise TaskTimeoutError("Flow deadline passed before the record was saved.")
+
     try:
-        record = OCRRecord(name=name, dob=dob, image_name=os.path.basename(file_path))
+        record = OCRRecord(
+            name=name,
+            dob=dob,
+            image_name=image_key,
+            name_normalized=normalize_name(name),
+            dob_date=parse_dob(dob),
+        )
         db.add(record)
-        db.commit()
-        db.refresh(record)
+        db.flush()
 
+        # One commit for both, so a record never exists without its flow link
+        # (a failed flow releases its upload; see main.upload_image)
         flow.related_record_id = record.id
         db.commit()
+        db.refresh(record)
         logger.info(f"✅ Record saved to database with ID {record.id}")
         return record
     except Exception as e: